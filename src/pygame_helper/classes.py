@@ -1,14 +1,20 @@
-import pygame, math
+import pygame, math, heapq, time, threading, weakref, mmap, struct, sys, zlib
 from pygame_helper.graphics import *
 from random import uniform, choice
+from collections import deque
 from typing import Union,List, Tuple
 import pygame_helper.sprites as sprites
 from pygame import Rect
 from pygame.font import Font
+from itertools import chain
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+try:
+	import numpy
+except ImportError:
+	numpy = None
 # pathfining
 from pathfinding.core.grid import Grid
-from pathfinding.finder.a_star import AStarFinder
-from pathfinding.core.diagonal_movement import DiagonalMovement
 
 """
 This module contains useful classes to use in the game such as particles, trails, text, timers, buttons.
@@ -162,28 +168,128 @@ class Background():
 		self.window.blit(self.image,(0,0))
 
 # PATHFINING
+LANDMARKS_FILE_HEADER = "<4sBBIIIH"
+
+def landmark_distances(cells:bytes,width:int,height:int,allow_diagonal_movement:bool,landmark:Tuple[int,int])->bytes:
+	"""
+	Return the distances from a landmark to every cell of a flat matrix, as float32 bytes (inf where unreachable).
+
+	It's a module function so 'PathFinder.precompute_landmarks' can run it in a process pool.
+	"""
+	directions = [(1,0,1),(-1,0,1),(0,1,1),(0,-1,1)]
+	if allow_diagonal_movement:
+		directions += [(1,1,math.sqrt(2)),(-1,1,math.sqrt(2)),(1,-1,math.sqrt(2)),(-1,-1,math.sqrt(2))]
+	distances = [math.inf]*(width*height)
+	start = landmark[1]*width+landmark[0]
+	distances[start] = 0
+	open_nodes = [(0,start)]
+	while open_nodes:
+		distance,index = heapq.heappop(open_nodes)
+		if distance > distances[index]:
+			continue
+		y,x = divmod(index,width)
+		for dx,dy,cost in directions:
+			nx,ny = x+dx,y+dy
+			if 0 <= nx < width and 0 <= ny < height:
+				other = ny*width+nx
+				if cells[other] != 0 and distance+cost < distances[other]:
+					distances[other] = distance+cost
+					heapq.heappush(open_nodes,(distance+cost,other))
+	table = array("f",distances)
+	if sys.byteorder == "big":
+		table.byteswap()
+	return table.tobytes()
+
 class PathFinder():
 	"""
 	A useful pathfinding class to easly find paths for your sprites and making them follow the path.
+
+	The matrix can be a list of lists or a NumPy array, check also 'from_bytes', 'from_mask' and 'from_surface'.
 	"""
 	def __init__(self,matrix:List[List[int]],cell_pixel_size:int,allow_diagonal_movement:bool=True):
+		if numpy is not None and isinstance(matrix,numpy.ndarray):
+			if matrix.ndim != 2:
+				raise ValueError("The matrix array must have 2 dimensions.")
+			if not ((matrix == 0) | (matrix == 1)).all():
+				raise ValueError("Matrix values must be either 0 or 1.")
+			matrix = PathFinder._rows(bytearray(numpy.ascontiguousarray(matrix,dtype=numpy.uint8).tobytes()),matrix.shape[1],matrix.shape[0])
+		elif not set(chain.from_iterable(matrix)) <= {0,1}:
+			raise ValueError("Matrix values must be either 0 or 1.")
 		self.matrix = matrix
 
-		for row in self.matrix:
-			for col in row:
-				if col not in [0,1]:
-					raise ValueError("Matrix values must be either 0 or 1.")
-
-		self.grid = Grid(len(self.matrix[0]),len(self.matrix),self.matrix)
+		self._grid = None
 		self.width = len(self.matrix[0])
 		self.height = len(self.matrix)
 		self.cell_size = cell_pixel_size
-		if allow_diagonal_movement:
-			self.finder = AStarFinder(diagonal_movement=DiagonalMovement.always)
-		else:
-			self.finder = AStarFinder()
 		self.current_path = []
 		self.collision_rects = []
+		if allow_diagonal_movement:
+			self._directions = [(1,0,1),(-1,0,1),(0,1,1),(0,-1,1),(1,1,math.sqrt(2)),(-1,1,math.sqrt(2)),(1,-1,math.sqrt(2)),(-1,-1,math.sqrt(2))]
+		else:
+			self._directions = [(1,0,1),(-1,0,1),(0,1,1),(0,-1,1)]
+		self.allow_diagonal_movement = allow_diagonal_movement
+		self._planners = weakref.WeakSet()
+		self.landmarks = []
+		self._landmark_tables = []
+		self._landmarks_file = None
+
+	@staticmethod
+	def from_bytes(buffer:bytes,width:int,height:int,cell_pixel_size:int,allow_diagonal_movement:bool=True):
+		"""
+		Return a pathfinder made from a buffer of width*height bytes (row by row) that are either 0 or 1. This is a static method, working as a second constructor.
+		"""
+		data = bytearray(buffer)
+		if len(data) != width*height:
+			raise ValueError("The buffer size must be width*height.")
+		if data.translate(None,b"\x00\x01"):
+			raise ValueError("Matrix values must be either 0 or 1.")
+		return PathFinder(PathFinder._rows(data,width,height),cell_pixel_size,allow_diagonal_movement)
+
+	@staticmethod
+	def from_mask(mask:pygame.mask.Mask,cell_pixel_size:int,allow_diagonal_movement:bool=True,invert:bool=False):
+		"""
+		Return a pathfinder where every set bit of the mask is a walkable cell (or a wall, with 'invert'). This is a static method, working as a second constructor.
+		"""
+		width,height = mask.get_size()
+		surface = mask.to_surface(setcolor=(255,255,255,255),unsetcolor=(0,0,0,255))
+		to_bytes = getattr(pygame.image,"tobytes",None) or pygame.image.tostring
+		table = bytes([1]*255+[0]) if invert else bytes([0]*255+[1])
+		data = bytearray(to_bytes(surface,"RGBA")[0::4].translate(table))
+		return PathFinder(PathFinder._rows(data,width,height),cell_pixel_size,allow_diagonal_movement)
+
+	@staticmethod
+	def from_surface(surface:pygame.Surface,cell_pixel_size:int,allow_diagonal_movement:bool=True,walkable_color:Union[str,Tuple[int,int,int]]=None,alpha_threshold:int=127,invert:bool=False):
+		"""
+		Return a pathfinder where every pixel of the surface is a cell. This is a static method, working as a second constructor.
+
+		The pixels of the walkable color (or the opaque ones, if no color is given) are walkable. With 'invert' they are the walls instead.
+		"""
+		if walkable_color is not None:
+			mask = pygame.mask.from_threshold(surface,pygame.Color(walkable_color),(1,1,1,255))
+		else:
+			mask = pygame.mask.from_surface(surface,alpha_threshold)
+		return PathFinder.from_mask(mask,cell_pixel_size,allow_diagonal_movement,invert)
+
+	@staticmethod
+	def _rows(data:bytearray,width:int,height:int)->List[memoryview]:
+		"""
+		Split a flat buffer in rows that share its memory.
+		"""
+		view = memoryview(data)
+		return [view[y*width:(y+1)*width] for y in range(height)]
+
+	@property
+	def grid(self)->Grid:
+		"""
+		The grid of the pathfinding library, only created when needed.
+		"""
+		if self._grid is None:
+			self._grid = Grid(self.width,self.height,self.matrix)
+		return self._grid
+
+	@grid.setter
+	def grid(self,value:Grid):
+		self._grid = value
 
 	def validate_target(self,target_grid_coordinate:Tuple[int,int])->bool:
 		"""
@@ -213,10 +319,9 @@ class PathFinder():
 		Makes one sprite follow the path.
 		"""
 		if self.collision_rects:
-			for rect in self.collision_rects:
-				if rect.collidepoint(sprite.rect.center):
-					del self.collision_rects[0]
-					self.set_sprite_direction(sprite)
+			if self.collision_rects[0].collidepoint(sprite.rect.center):
+				del self.collision_rects[0]
+				self.set_sprite_direction(sprite)
 		else:
 			if self.current_path:
 				self.empty_path()
@@ -238,11 +343,15 @@ class PathFinder():
 		"""
 		Create collision rects in the path points to allow sprites to follow it.
 		"""
-		self.collision_rects.clear()
-		if self.current_path:
-			self.collision_rects = [pygame.Rect(((point[0]*self.cell_size)+self.cell_size//2-rect_size//2,(point[1]*self.cell_size)+self.cell_size//2-rect_size//2),(rect_size,rect_size)) for point in self.current_path]
+		self.collision_rects = self.path_collision_rects(self.current_path,rect_size)
 		return self.collision_rects
 
+	def path_collision_rects(self,path:List[Tuple[int,int]],rect_size:int=4)->List[pygame.Rect]:
+		"""
+		Return the collision rects of any path, without changing the current one.
+		"""
+		return [pygame.Rect(((point[0]*self.cell_size)+self.cell_size//2-rect_size//2,(point[1]*self.cell_size)+self.cell_size//2-rect_size//2),(rect_size,rect_size)) for point in path]
+
 	def draw_path(self,surface:pygame.Surface=None,color:Union[str,Tuple[int,int,int]]="white",line_width:int=3,shift_offset:Union[str,int]="cell_center"):
 		"""
 		Draw the path if one exists.
@@ -267,19 +376,739 @@ class PathFinder():
 		"""
 		return int(pixel_coordinate[0]//self.cell_size),int(pixel_coordinate[1]//self.cell_size)
 
-	def create_path(self,start_grid_coordinate:Tuple[int,int],end_grid_coordinate:Tuple[int,int],sprite:sprites.Sprite=None,collision_rects_size=4)->Tuple[List[Tuple[int,int]],List[pygame.Rect]]:
+	def create_path(self,start_grid_coordinate:Tuple[int,int],end_grid_coordinate:Tuple[int,int],sprite:sprites.Sprite=None,collision_rects_size=4,smooth:bool=False)->Tuple[List[Tuple[int,int]],List[pygame.Rect]]:
 		"""
 		Create a new path between two grid positions. If a sprite is given, it will start following the path.
+
+		With 'smooth' the path only keeps the corner points, check 'smooth_path'.
 		"""
-		start = self.grid.node(start_grid_coordinate[0], start_grid_coordinate[1])
-		end = self.grid.node(end_grid_coordinate[0], end_grid_coordinate[1])
-		self.current_path,_ = self.finder.find_path(start, end, self.grid)
-		self.grid.cleanup()
+		self.current_path = self.find_path(start_grid_coordinate,end_grid_coordinate,smooth)
 		self.create_path_collision_rects(collision_rects_size)
 		if sprite:
 			self.set_sprite_direction(sprite)
 		return self.current_path, self.collision_rects
 
+	def find_path(self,start_grid_coordinate:Tuple[int,int],end_grid_coordinate:Tuple[int,int],smooth:bool=False)->List[Tuple[int,int]]:
+		"""
+		Return the path between two grid positions without changing the current path. An empty list means there is no path.
+		"""
+		search = self.search(start_grid_coordinate,end_grid_coordinate)
+		while True:
+			try:
+				next(search)
+			except StopIteration as result:
+				return self.smooth_path(result.value) if smooth else result.value
+
+	def smooth_path(self,path:List[Tuple[int,int]])->List[Tuple[int,int]]:
+		"""
+		Return the path with only the points where it needs to turn.
+
+		Collinear points are removed first, then every point that can be skipped keeping the line of sight is removed. Every joined segment keeps the line of sight, the single steps are left as the search made them.
+		"""
+		if len(path) < 3:
+			return list(path)
+		points = [path[0]]
+		for previous,point,following in zip(path,path[1:],path[2:]):
+			# diagonal runs can pass between two walls, joining them would cut through
+			if (point[0]-previous[0],point[1]-previous[1]) != (following[0]-point[0],following[1]-point[1]) or not self.line_of_sight(points[-1],following):
+				points.append(point)
+		points.append(path[-1])
+
+		smoothed = [points[0]]
+		anchor = points[0]
+		for point,following in zip(points[1:],points[2:]):
+			if not self.line_of_sight(anchor,following):
+				smoothed.append(point)
+				anchor = point
+		smoothed.append(points[-1])
+		return smoothed
+
+	def line_of_sight(self,start_grid_coordinate:Tuple[int,int],end_grid_coordinate:Tuple[int,int])->bool:
+		"""
+		Check if the straight line between the centers of two cells only crosses walkable cells.
+
+		Every cell the line touches is checked (supercover), and passing exactly on a corner needs both cells around it to be walkable.
+		"""
+		x,y = int(start_grid_coordinate[0]),int(start_grid_coordinate[1])
+		end_x,end_y = int(end_grid_coordinate[0]),int(end_grid_coordinate[1])
+		if not self.validate_target((x,y)) or not self.validate_target((end_x,end_y)):
+			return False
+		nx,ny = abs(end_x-x),abs(end_y-y)
+		sign_x = 1 if end_x > x else -1
+		sign_y = 1 if end_y > y else -1
+		matrix = self.matrix
+		ix = iy = 0
+		while ix < nx or iy < ny:
+			decision = (1+2*ix)*ny-(1+2*iy)*nx
+			if decision == 0:
+				if matrix[y][x+sign_x] == 0 or matrix[y+sign_y][x] == 0:
+					return False
+				x += sign_x
+				y += sign_y
+				ix += 1
+				iy += 1
+			elif decision < 0:
+				x += sign_x
+				ix += 1
+			else:
+				y += sign_y
+				iy += 1
+			if matrix[y][x] == 0:
+				return False
+		return True
+
+	def search(self,start_grid_coordinate:Tuple[int,int],end_grid_coordinate:Tuple[int,int]):
+		"""
+		A* search as a generator, yielding after every explored node so it can be paused and resumed.
+
+		When the generator ends, the path is the StopIteration value. Used by 'find_path' and 'PathRequestQueue'.
+		"""
+		start = (int(start_grid_coordinate[0]),int(start_grid_coordinate[1]))
+		end = (int(end_grid_coordinate[0]),int(end_grid_coordinate[1]))
+		if not self.validate_target(start) or not self.validate_target(end):
+			return []
+		if end in self.landmarks or start in self.landmarks:
+			return self._landmark_path(start,end)
+		open_nodes = [(self._heuristic(start,end),0,start)]
+		came_from = {start:None}
+		costs = {start:0}
+		while open_nodes:
+			_,cost,current = heapq.heappop(open_nodes)
+			cost = -cost
+			if current == end:
+				path = []
+				while current:
+					path.append(current)
+					current = came_from[current]
+				path.reverse()
+				return path
+			if cost > costs[current]:
+				continue
+			for x,y,step_cost in self._neighbours(current[0],current[1]):
+				new_cost = cost+step_cost
+				node = (x,y)
+				if new_cost < costs.get(node,math.inf):
+					costs[node] = new_cost
+					came_from[node] = current
+					heapq.heappush(open_nodes,(new_cost+self._heuristic(node,end),-new_cost,node))
+			yield
+		return []
+
+	def set_cell(self,grid_coordinate:Tuple[int,int],value:int):
+		"""
+		Change a cell of the matrix (0 is a wall, 1 is walkable). The incremental planners will repair their paths on their next update.
+		"""
+		if value not in [0,1]:
+			raise ValueError("Matrix values must be either 0 or 1.")
+		x,y = int(grid_coordinate[0]),int(grid_coordinate[1])
+		if self.matrix[y][x] == value:
+			return
+		self.matrix[y][x] = value
+		if self._grid is not None:
+			node = self._grid.node(x,y)
+			node.walkable = value != 0
+			node.weight = value
+		for planner in self._planners:
+			planner._changed_cells.add((x,y))
+		if self.landmarks:
+			self.clear_landmarks()
+
+	def precompute_landmarks(self,count:int=8,landmarks:List[Tuple[int,int]]=None,processes:int=1)->List[Tuple[int,int]]:
+		"""
+		Compute the distance from some landmarks to every cell, making A* much faster (ALT heuristic), and return the landmarks.
+
+		The paths that start or end on a landmark are found instantly: pass the common destinations as 'landmarks', otherwise 'count' cells are picked around the border of the map.
+
+		The tables are computed in this process, pass more 'processes' (or None for one per CPU) to use a process pool. The pool runs your main file again in every worker on Windows and macOS, so the game code must be under 'if __name__ == "__main__":'.
+
+		The tables can be saved with 'save_landmarks'. Changing a cell clears them.
+		"""
+		if landmarks is None:
+			landmarks = self._border_landmarks(count)
+		landmarks = [(int(x),int(y)) for x,y in landmarks]
+		for landmark in landmarks:
+			if not self.validate_target(landmark):
+				raise ValueError("Landmarks must be walkable cells inside the matrix.")
+		cells = self._matrix_bytes()
+		arguments = [(cells,self.width,self.height,self.allow_diagonal_movement,landmark) for landmark in landmarks]
+		if processes == 1 or len(landmarks) <= 1:
+			tables = [landmark_distances(*argument) for argument in arguments]
+		else:
+			with ProcessPoolExecutor(processes) as pool:
+				tables = list(pool.map(landmark_distances,*zip(*arguments)))
+		self.clear_landmarks()
+		self.landmarks = landmarks
+		self._landmark_tables = [self._load_table(table) for table in tables]
+		return self.landmarks
+
+	def save_landmarks(self,file_path:str):
+		"""
+		Save the landmark tables in a binary file, to be loaded with 'load_landmarks' instead of computing them again.
+		"""
+		if not self.landmarks:
+			raise AttributeError("There are no landmarks to save, call 'precompute_landmarks' first.")
+		with open(file_path,"wb") as file:
+			file.write(struct.pack(LANDMARKS_FILE_HEADER,b"PHLM",1,self.allow_diagonal_movement,self.width,self.height,zlib.crc32(self._matrix_bytes()),len(self.landmarks)))
+			for landmark in self.landmarks:
+				file.write(struct.pack("<II",landmark[0],landmark[1]))
+			for table in self._landmark_tables:
+				table = array("f",table)
+				if sys.byteorder == "big":
+					table.byteswap()
+				file.write(table.tobytes())
+
+	def load_landmarks(self,file_path:str):
+		"""
+		Load the landmark tables saved by 'save_landmarks'. The file is memory-mapped, not read.
+
+		Raise a ValueError if the file was made with a different matrix.
+		"""
+		with open(file_path,"rb") as file:
+			mapped = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+		header_size = struct.calcsize(LANDMARKS_FILE_HEADER)
+		magic,version,diagonal,width,height,checksum,count = struct.unpack_from(LANDMARKS_FILE_HEADER,mapped)
+		if magic != b"PHLM" or version != 1:
+			raise ValueError("The file is not a landmarks file.")
+		if (width,height,bool(diagonal)) != (self.width,self.height,self.allow_diagonal_movement) or checksum != zlib.crc32(self._matrix_bytes()):
+			raise ValueError("The landmarks file was made for a different matrix.")
+		self.clear_landmarks()
+		self.landmarks = [struct.unpack_from("<II",mapped,header_size+i*8) for i in range(count)]
+		table_size = width*height*4
+		start = header_size+count*8
+		self._landmark_tables = [self._load_table(memoryview(mapped)[start+i*table_size:start+(i+1)*table_size]) for i in range(count)]
+		self._landmarks_file = mapped
+
+	def clear_landmarks(self):
+		"""
+		Remove the landmarks and their tables.
+		"""
+		self.landmarks = []
+		self._landmark_tables = []
+		self._landmarks_file = None
+
+	def landmark_distance(self,landmark:Tuple[int,int],grid_coordinate:Tuple[int,int])->float:
+		"""
+		Return the exact path lenght between a landmark and a cell (inf if there is no path).
+		"""
+		table = self._landmark_tables[self.landmarks.index((landmark[0],landmark[1]))]
+		return table[int(grid_coordinate[1])*self.width+int(grid_coordinate[0])]
+
+	def _load_table(self,data:Union[bytes,memoryview]):
+		"""
+		Return a float table from little endian bytes, without copying them when possible.
+		"""
+		if sys.byteorder == "big":
+			table = array("f",bytes(data))
+			table.byteswap()
+			return table
+		return memoryview(data).cast("f")
+
+	def _matrix_bytes(self)->bytes:
+		return b"".join(bytes(row) for row in self.matrix)
+
+	def _border_landmarks(self,count:int)->List[Tuple[int,int]]:
+		"""
+		Pick the walkable cells closest to points spread around the border of the matrix.
+		"""
+		landmarks = []
+		center_x,center_y = (self.width-1)/2,(self.height-1)/2
+		for i in range(count):
+			angle = math.tau*i/count
+			dx,dy = math.cos(angle),math.sin(angle)
+			scale = min(center_x/abs(dx) if abs(dx) > 1e-9 else math.inf,center_y/abs(dy) if abs(dy) > 1e-9 else math.inf)
+			landmark = self._nearest_walkable((round(center_x+dx*scale),round(center_y+dy*scale)))
+			if landmark and landmark not in landmarks:
+				landmarks.append(landmark)
+		return landmarks
+
+	def _nearest_walkable(self,grid_coordinate:Tuple[int,int])->Tuple[int,int]:
+		x,y = grid_coordinate
+		for radius in range(max(self.width,self.height)):
+			ring = [(x+i,y-radius) for i in range(-radius,radius+1)]+[(x+i,y+radius) for i in range(-radius,radius+1)]
+			ring += [(x-radius,y+i) for i in range(-radius+1,radius)]+[(x+radius,y+i) for i in range(-radius+1,radius)]
+			for cell in ring:
+				if self.validate_target(cell):
+					return cell
+		return None
+
+	def _landmark_path(self,start:Tuple[int,int],end:Tuple[int,int])->List[Tuple[int,int]]:
+		"""
+		Walk down the distances of a landmark table to build a path from or to the landmark.
+		"""
+		reverse = end not in self.landmarks
+		node,landmark = (end,start) if reverse else (start,end)
+		table = self._landmark_tables[self.landmarks.index(landmark)]
+		if table[node[1]*self.width+node[0]] == math.inf:
+			return []
+		path = [node]
+		while node != landmark:
+			best,best_distance = None,math.inf
+			for x,y,cost in self._neighbours(node[0],node[1]):
+				distance = cost+table[y*self.width+x]
+				if distance < best_distance:
+					best,best_distance = (x,y),distance
+			node = best
+			path.append(node)
+		if reverse:
+			path.reverse()
+		return path
+
+	def create_planner(self,start_grid_coordinate:Tuple[int,int],end_grid_coordinate:Tuple[int,int])->"IncrementalPlanner":
+		"""
+		Return an incremental planner for one agent. After the matrix changes with 'set_cell', the planner only repairs the part of the path affected.
+		"""
+		return IncrementalPlanner(self,start_grid_coordinate,end_grid_coordinate)
+
+	def _neighbours(self,x:int,y:int):
+		"""
+		Yield the walkable neighbours of a node with the cost to reach them.
+		"""
+		for dx,dy,cost in self._directions:
+			nx,ny = x+dx,y+dy
+			if 0 <= nx < self.width and 0 <= ny < self.height and self.matrix[ny][nx] != 0:
+				yield nx,ny,cost
+
+	def _grid_distance(self,a:Tuple[int,int],b:Tuple[int,int])->float:
+		"""
+		Octile distance with diagonal movement, manhattan distance without.
+		"""
+		dx,dy = abs(a[0]-b[0]),abs(a[1]-b[1])
+		if self.allow_diagonal_movement:
+			return dx+dy+(math.sqrt(2)-2)*min(dx,dy)
+		return dx+dy
+
+	def _heuristic(self,a:Tuple[int,int],b:Tuple[int,int])->float:
+		"""
+		The grid distance, improved with the landmark tables if there are some (triangle inequality).
+		"""
+		distance = self._grid_distance(a,b)
+		a_index,b_index = a[1]*self.width+a[0],b[1]*self.width+b[0]
+		for table in self._landmark_tables:
+			a_distance,b_distance = table[a_index],table[b_index]
+			if a_distance != math.inf and b_distance != math.inf:
+				# float32 tables, the margin keeps the heuristic admissible
+				distance = max(distance,abs(a_distance-b_distance)-0.01)
+		return distance
+
+class IncrementalPlanner():
+	"""
+	A D* Lite planner that keeps its search state, so the path can be repaired instead of searched again when the matrix changes.
+
+	Create it with 'PathFinder.create_planner', then call 'update' with the agent position every time a new path is needed.
+	"""
+	def __init__(self,pathfinder:PathFinder,start_grid_coordinate:Tuple[int,int],end_grid_coordinate:Tuple[int,int]):
+		self.pathfinder = pathfinder
+		self.start = (int(start_grid_coordinate[0]),int(start_grid_coordinate[1]))
+		self.goal = (int(end_grid_coordinate[0]),int(end_grid_coordinate[1]))
+		self.current_path = []
+
+		self._last_start = self.start
+		self._km = 0
+		self._g = {}
+		self._rhs = {self.goal:0}
+		self._open = {}
+		self._heap = []
+		self._changed_cells = set()
+		self._push(self.goal)
+		pathfinder._planners.add(self)
+
+	def update(self,start_grid_coordinate:Tuple[int,int]=None)->List[Tuple[int,int]]:
+		"""
+		Repair the path after the matrix changes (optionally from a new agent position) and return it. An empty list means there is no path.
+		"""
+		if start_grid_coordinate:
+			self.start = (int(start_grid_coordinate[0]),int(start_grid_coordinate[1]))
+		if self.start != self._last_start or self._changed_cells:
+			self._km += self.pathfinder._grid_distance(self._last_start,self.start)
+			self._last_start = self.start
+		for cell in self._changed_cells:
+			self._update_node(cell)
+			for node,_ in self._around(cell):
+				self._update_node(node)
+		self._changed_cells.clear()
+		self._compute()
+		self.current_path = self._extract_path()
+		return self.current_path
+
+	def close(self):
+		"""
+		Stop receiving the matrix changes of the pathfinder.
+		"""
+		self.pathfinder._planners.discard(self)
+
+	def _key(self,node:Tuple[int,int])->Tuple[float,float]:
+		value = min(self._g.get(node,math.inf),self._rhs.get(node,math.inf))
+		# rounded so that equal keys made of diagonal costs compare as equal
+		return (round(value+self.pathfinder._grid_distance(self.start,node)+self._km,9),value)
+
+	def _push(self,node:Tuple[int,int]):
+		key = self._key(node)
+		self._open[node] = key
+		heapq.heappush(self._heap,(key,node))
+
+	def _top(self):
+		"""
+		Return the node with the smallest key, discarding the outdated heap entries.
+		"""
+		while self._heap:
+			key,node = self._heap[0]
+			if self._open.get(node) == key:
+				return key,node
+			heapq.heappop(self._heap)
+		return None
+
+	def _around(self,node:Tuple[int,int]):
+		"""
+		Yield every neighbour inside the grid (walls included) with the movement cost.
+		"""
+		pathfinder = self.pathfinder
+		for dx,dy,cost in pathfinder._directions:
+			x,y = node[0]+dx,node[1]+dy
+			if 0 <= x < pathfinder.width and 0 <= y < pathfinder.height:
+				yield (x,y),cost
+
+	def _walkable(self,node:Tuple[int,int])->bool:
+		return self.pathfinder.matrix[node[1]][node[0]] != 0
+
+	def _update_node(self,node:Tuple[int,int]):
+		if node != self.goal:
+			rhs = math.inf
+			if self._walkable(node):
+				for other,cost in self._around(node):
+					if self._walkable(other):
+						rhs = min(rhs,cost+self._g.get(other,math.inf))
+			self._rhs[node] = rhs
+		self._open.pop(node,None)
+		if self._g.get(node,math.inf) != self._rhs.get(node,math.inf):
+			self._push(node)
+
+	def _compute(self):
+		while True:
+			top = self._top()
+			if not top:
+				break
+			if top[0] >= self._key(self.start) and self._rhs.get(self.start,math.inf) == self._g.get(self.start,math.inf):
+				break
+			old_key,node = top
+			heapq.heappop(self._heap)
+			del self._open[node]
+			new_key = self._key(node)
+			if old_key < new_key:
+				self._push(node)
+			elif self._g.get(node,math.inf) > self._rhs.get(node,math.inf):
+				self._g[node] = self._rhs[node]
+				for other,_ in self._around(node):
+					self._update_node(other)
+			else:
+				self._g[node] = math.inf
+				self._update_node(node)
+				for other,_ in self._around(node):
+					self._update_node(other)
+
+	def _extract_path(self)->List[Tuple[int,int]]:
+		if self._g.get(self.start,math.inf) == math.inf or not self._walkable(self.start):
+			return []
+		path = [self.start]
+		node = self.start
+		for _ in range(self.pathfinder.width*self.pathfinder.height):
+			if node == self.goal:
+				return path
+			best,best_cost = None,math.inf
+			for other,cost in self._around(node):
+				if self._walkable(other):
+					total = cost+self._g.get(other,math.inf)
+					if total < best_cost:
+						best,best_cost = other,total
+			if not best:
+				return []
+			node = best
+			path.append(node)
+		return []
+
+class PathRequestQueue():
+	"""
+	Spread the path requests over multiple frames, to avoid a hitch when a lot of sprites need a path at the same time.
+
+	Call 'update' every frame: the searches will run for at most 'time_budget' microseconds and the finished ones are sent to their callbacks as 'callback(path,collision_rects)'.
+
+	With 'use_thread' the searches run on a worker thread instead, and 'update' only calls the callbacks.
+
+	Requests with the same start and end are searched once, and requests of sprites that got killed are dropped.
+	"""
+	def __init__(self,pathfinder:PathFinder,time_budget:int=2000,use_thread:bool=False,collision_rects_size:int=4,smooth:bool=False):
+		self.pathfinder = pathfinder
+		self.time_budget = time_budget
+		self.collision_rects_size = collision_rects_size
+		self.smooth = smooth
+
+		self._requests = {}
+		self._order = deque()
+		self._current = None
+		self._results = deque()
+		self._lock = threading.Lock()
+		self._wake = threading.Event()
+		self._thread = None
+		if use_thread:
+			self._thread = threading.Thread(target=self._work,daemon=True)
+			self._thread.start()
+
+	def __len__(self):
+		return len(self._requests)
+
+	def submit(self,start_grid_coordinate:Tuple[int,int],end_grid_coordinate:Tuple[int,int],callback,owner:sprites.Sprite=None)->Tuple[Tuple[int,int],Tuple[int,int]]:
+		"""
+		Add a path request and return its key. If the owner sprite gets killed before the path is ready, the callback is not called.
+		"""
+		key = ((int(start_grid_coordinate[0]),int(start_grid_coordinate[1])),(int(end_grid_coordinate[0]),int(end_grid_coordinate[1])))
+		owner_alive = owner is not None and hasattr(owner,"alive") and owner.alive()
+		with self._lock:
+			if key not in self._requests:
+				self._requests[key] = []
+				self._order.append(key)
+			self._requests[key].append((callback,owner,owner_alive))
+		self._wake.set()
+		return key
+
+	def cancel(self,owner:sprites.Sprite)->int:
+		"""
+		Remove all the requests of a sprite and return how many were removed.
+		"""
+		removed = 0
+		with self._lock:
+			for key in list(self._requests.keys()):
+				callbacks = self._requests[key]
+				kept = [request for request in callbacks if request[1] is not owner]
+				removed += len(callbacks)-len(kept)
+				if kept:
+					self._requests[key] = kept
+				else:
+					del self._requests[key]
+		return removed
+
+	def cancel_request(self,key:Tuple[Tuple[int,int],Tuple[int,int]]):
+		"""
+		Remove a request (and all of its callbacks) using the key returned by 'submit'.
+		"""
+		with self._lock:
+			self._requests.pop(key,None)
+
+	def clear(self):
+		"""
+		Remove every request and every result not delivered yet.
+		"""
+		with self._lock:
+			self._requests.clear()
+			self._order.clear()
+			self._results.clear()
+			self._current = None
+
+	def stop(self):
+		"""
+		Stop the worker thread, if there is one.
+		"""
+		if self._thread:
+			thread = self._thread
+			self._thread = None
+			self._wake.set()
+			thread.join()
+
+	def update(self)->int:
+		"""
+		Advance the searches (if not using a thread) and call the callbacks of the finished ones. Return how many paths were delivered.
+		"""
+		if not self._thread:
+			deadline = time.perf_counter()+self.time_budget/1000000
+			steps = 0
+			while True:
+				if not self._current:
+					key = self._next_key()
+					if not key:
+						break
+					self._current = (key,self.pathfinder.search(key[0],key[1]))
+				key,search = self._current
+				if key not in self._requests:
+					self._current = None
+					continue
+				try:
+					next(search)
+				except StopIteration as result:
+					self._results.append((key,self.pathfinder.smooth_path(result.value) if self.smooth else result.value))
+					self._current = None
+				steps += 1
+				if steps%16 == 0 and time.perf_counter() >= deadline:
+					break
+		return self._deliver()
+
+	def _next_key(self):
+		"""
+		Pop the next request still waiting, dropping the ones whose sprites are all dead.
+		"""
+		with self._lock:
+			while self._order:
+				key = self._order.popleft()
+				if key in self._requests:
+					callbacks = [request for request in self._requests[key] if not self._is_dead(request)]
+					if callbacks:
+						self._requests[key] = callbacks
+						return key
+					del self._requests[key]
+		return None
+
+	def _deliver(self)->int:
+		"""
+		Call the callbacks of the finished searches.
+		"""
+		delivered = 0
+		while True:
+			with self._lock:
+				if not self._results:
+					break
+				key,path = self._results.popleft()
+				callbacks = self._requests.pop(key,None)
+			if callbacks:
+				collision_rects = self.pathfinder.path_collision_rects(path,self.collision_rects_size)
+				for request in callbacks:
+					if not self._is_dead(request):
+						request[0](list(path),[rect.copy() for rect in collision_rects])
+				delivered += 1
+		return delivered
+
+	def _is_dead(self,request)->bool:
+		return request[2] and not request[1].alive()
+
+	def _work(self):
+		"""
+		Worker thread loop.
+		"""
+		while self._thread:
+			key = self._next_key()
+			if not key:
+				self._wake.wait()
+				self._wake.clear()
+				continue
+			path = self.pathfinder.find_path(key[0],key[1],self.smooth)
+			with self._lock:
+				if key in self._requests:
+					self._results.append((key,path))
+
+class PathFollower():
+	"""
+	Make a sprite follow a path while sharing one PathFinder (and its grid) with every other sprite.
+
+	Only the next waypoint is checked on update, with a squared distance. A waypoint also counts as reached when the sprite walks past it.
+	"""
+	def __init__(self,pathfinder:PathFinder,sprite:sprites.Sprite,arrive_distance:float=2):
+		self.pathfinder = pathfinder
+		self.sprite = sprite
+		self.arrive_distance = arrive_distance
+		self.path = []
+		self.waypoints = []
+		self.index = 0
+
+	@property
+	def finished(self)->bool:
+		return self.index >= len(self.waypoints)
+
+	def set_path(self,path:List[Tuple[int,int]]):
+		"""
+		Start following a path of grid positions.
+		"""
+		half = self.pathfinder.cell_size/2
+		cell_size = self.pathfinder.cell_size
+		self.path = path
+		self.waypoints = [(point[0]*cell_size+half,point[1]*cell_size+half) for point in path]
+		self.index = 0
+		self._aim()
+
+	def create_path(self,end_grid_coordinate:Tuple[int,int],start_grid_coordinate:Tuple[int,int]=None,smooth:bool=False)->List[Tuple[int,int]]:
+		"""
+		Find a path to a grid position and start following it. By default the path starts from the sprite position.
+		"""
+		if not start_grid_coordinate:
+			start_grid_coordinate = self.pathfinder.pixel_to_grid(self.sprite.position)
+		path = self.pathfinder.find_path(start_grid_coordinate,end_grid_coordinate,smooth)
+		self.set_path(path)
+		return path
+
+	def stop(self):
+		"""
+		Forget the path and stop the sprite.
+		"""
+		self.path = []
+		self.waypoints = []
+		self.index = 0
+		self.sprite.direction.xy = (0,0)
+
+	def update(self)->bool:
+		"""
+		Advance to the next waypoint if the current one is reached. Return False once the path is finished.
+		"""
+		if self.index >= len(self.waypoints):
+			return False
+		position = self.sprite.position
+		direction = self.sprite.direction
+		x,y = self.waypoints[self.index]
+		dx,dy = x-position.x,y-position.y
+		if dx*dx+dy*dy <= self.arrive_distance*self.arrive_distance or dx*direction.x+dy*direction.y < 0:
+			self.index += 1
+			return self._aim()
+		return True
+
+	def _aim(self)->bool:
+		"""
+		Point the sprite direction to the next waypoint, skipping the ones it is already on.
+		"""
+		position = self.sprite.position
+		while self.index < len(self.waypoints):
+			x,y = self.waypoints[self.index]
+			dx,dy = x-position.x,y-position.y
+			length = math.sqrt(dx*dx+dy*dy)
+			if length > self.arrive_distance:
+				self.sprite.direction.xy = (dx/length,dy/length)
+				return True
+			self.index += 1
+		self.sprite.direction.xy = (0,0)
+		return False
+
+class PathFollowerGroup():
+	"""
+	Update a lot of path followers in one call.
+	"""
+	def __init__(self,followers:List[PathFollower]=[]):
+		self.followers = list(followers)
+
+	def __len__(self):
+		return len(self.followers)
+
+	def __iter__(self):
+		return iter(self.followers)
+
+	def add(self,*followers:PathFollower):
+		self.followers.extend(followers)
+
+	def remove(self,*followers:PathFollower):
+		for follower in followers:
+			self.followers.remove(follower)
+
+	def update(self,remove_finished:bool=False,remove_dead:bool=False)->int:
+		"""
+		Update every follower and return how many are still following a path.
+
+		With 'remove_dead' the followers of sprites that are not in any group are removed, with 'remove_finished' the ones that reached the end.
+		"""
+		kept = []
+		following = 0
+		for follower in self.followers:
+			if remove_dead and not follower.sprite.alive():
+				continue
+			if follower.update():
+				following += 1
+				kept.append(follower)
+			elif not remove_finished:
+				kept.append(follower)
+		self.followers = kept
+		return following
+
 # GEOMETRY
 class Circle():
 	"""
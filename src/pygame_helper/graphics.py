@@ -1,5 +1,8 @@
-import pygame
+import pygame, json, re, weakref
 from os import walk
+from os.path import join, relpath, splitext
+from collections import OrderedDict
+from xml.etree import ElementTree
 from typing import Tuple,Union,Dict,List
 from random import randint,choice
 # pygame shortcuts
@@ -35,6 +38,98 @@ def scale_image(image:pygame.Surface,scale:float=None,sizes:Tuple[int,int]=None,
 		else:
 			return pygame.transform.smoothscale(image,(sizes[0],sizes[1]))
 
+# ROTATION CACHE
+rotation_cache_budget = 64*1024*1024
+rotation_steps = 360
+_rotation_cache = OrderedDict()
+_rotation_cache_size = 0
+
+def cached_rotate(image:pygame.Surface,angle:float,smooth:bool=False,steps:int=None)->pygame.Surface:
+	"""
+	Rotate an image reusing the rotations already made, from any sprite. The angle is rounded to a multiple of 360/steps degrees.
+
+	Do not draw on the returned surface, it's shared.
+	"""
+	global _rotation_cache_size
+	steps = steps or rotation_steps
+	step = round(angle*steps/360)%steps
+	key = (id(image),step,steps,smooth)
+	entry = _rotation_cache.get(key)
+	if entry and entry[0] is image:
+		_rotation_cache.move_to_end(key)
+		return entry[1]
+	if entry:
+		_rotation_cache_size -= _surface_size(entry[1])
+	angle = step*360/steps
+	rotated = pygame.transform.rotozoom(image,angle,1) if smooth else pygame.transform.rotate(image,angle)
+	# the source is kept alive in the entry so its id can't be reused
+	_rotation_cache[key] = (image,rotated)
+	_rotation_cache.move_to_end(key)
+	_rotation_cache_size += _surface_size(rotated)
+	_trim_rotation_cache()
+	return rotated
+
+def pregenerate_rotations(image:pygame.Surface,smooth:bool=False,steps:int=None)->List[pygame.Surface]:
+	"""
+	Rotate an image in every angle step at once (useful at load time) and return the list of rotations.
+	"""
+	steps = steps or rotation_steps
+	return [cached_rotate(image,step*360/steps,smooth,steps) for step in range(steps)]
+
+def set_rotation_cache(budget_bytes:int=None,steps:int=None)->None:
+	"""
+	Change the memory budget of the rotation cache and the default number of angle steps.
+	"""
+	global rotation_cache_budget,rotation_steps
+	if budget_bytes is not None:
+		rotation_cache_budget = budget_bytes
+	if steps is not None:
+		rotation_steps = steps
+	_trim_rotation_cache()
+
+def clear_rotation_cache()->None:
+	"""
+	Remove every cached rotation.
+	"""
+	global _rotation_cache_size
+	_rotation_cache.clear()
+	_rotation_cache_size = 0
+
+def _trim_rotation_cache():
+	"""
+	Remove the least recently used rotations until the cache fits the budget (the last one is always kept).
+	"""
+	global _rotation_cache_size
+	while _rotation_cache_size > rotation_cache_budget and len(_rotation_cache) > 1:
+		_,(_,old) = _rotation_cache.popitem(last=False)
+		_rotation_cache_size -= _surface_size(old)
+
+def _surface_size(surface:pygame.Surface)->int:
+	return surface.get_width()*surface.get_height()*surface.get_bytesize()
+
+# MASKS
+_mask_cache = weakref.WeakKeyDictionary()
+
+def get_mask(image:pygame.Surface)->pygame.mask.Mask:
+	"""
+	Return the mask of an image, made once and shared by every sprite using the same surface (also the rotation cache ones). It's removed with the surface.
+
+	After drawing on the image call 'clear_mask_cache' with it, the cached mask doesn't see the change.
+	"""
+	mask = _mask_cache.get(image)
+	if mask is None:
+		mask = _mask_cache[image] = pygame.mask.from_surface(image)
+	return mask
+
+def clear_mask_cache(image:pygame.Surface=None)->None:
+	"""
+	Remove the cached mask of an image, or all of them.
+	"""
+	if image is None:
+		_mask_cache.clear()
+	else:
+		_mask_cache.pop(image,None)
+
 # IMPORT
 def import_images_folder(folder_path:str,convert_alpha:bool=False,scale:float=None,scale_sizes:Tuple[int,int]=None)->list:
     """Return a list of images from a folder (useful for animations)."""
@@ -64,6 +159,106 @@ def import_images_folder_dict(folder_path:str,convert_alpha:bool=False,scale:flo
 
     return surface_list
 
+# SPRITE SHEETS
+def slice_sprite_sheet(sheet:pygame.Surface,frame_size:Tuple[int,int],count:int=None,margin:int=0,spacing:int=0)->List[pygame.Surface]:
+	"""
+	Return the frames of a sprite sheet made of a grid of same sized frames, row by row.
+
+	The frames are subsurfaces: they share the pixels of the sheet, nothing is copied.
+	"""
+	width,height = frame_size
+	columns = (sheet.get_width()-2*margin+spacing)//(width+spacing)
+	rows = (sheet.get_height()-2*margin+spacing)//(height+spacing)
+	frames = []
+	for row in range(rows):
+		for column in range(columns):
+			if count is not None and len(frames) >= count:
+				return frames
+			frames.append(sheet.subsurface((margin+column*(width+spacing),margin+row*(height+spacing),width,height)))
+	return frames
+
+def load_sprite_sheet(path:str,frame_size:Tuple[int,int],convert_alpha:bool=False,count:int=None,margin:int=0,spacing:int=0)->List[pygame.Surface]:
+	"""Load an image and slice it with 'slice_sprite_sheet'."""
+	return slice_sprite_sheet(load_image(path,convert_alpha),frame_size,count,margin,spacing)
+
+def load_atlas(image_path:str,index_path:str=None,convert_alpha:bool=False)->Dict[str,pygame.Surface]:
+	"""
+	Return a dict of the images of an atlas, as subsurfaces of the atlas image.
+
+	The index can be a JSON file (the one made by 'pack_atlas', the TexturePacker hash or array formats, or {name:[x,y,w,h]}) or an XML TextureAtlas file. By default it's the image path with the .json extension.
+	"""
+	atlas = load_image(image_path,convert_alpha)
+	if not index_path:
+		index_path = splitext(image_path)[0]+".json"
+	if index_path.lower().endswith(".xml"):
+		regions = {texture.get("name"):(int(texture.get("x")),int(texture.get("y")),int(texture.get("width")),int(texture.get("height"))) for texture in ElementTree.parse(index_path).getroot().iter("SubTexture")}
+	else:
+		with open(index_path,"r") as file:
+			index = json.load(file)
+		frames = index.get("frames",index)
+		if isinstance(frames,list):
+			frames = {frame["filename"]:frame for frame in frames}
+		regions = {}
+		for name,frame in frames.items():
+			if isinstance(frame,dict):
+				frame = frame.get("frame",frame)
+				regions[name] = (frame["x"],frame["y"],frame["w"],frame["h"])
+			else:
+				regions[name] = tuple(frame)
+	return {name:atlas.subsurface(region) for name,region in regions.items()}
+
+def atlas_animations(atlas:Dict[str,pygame.Surface])->Dict[str,List[pygame.Surface]]:
+	"""
+	Group the images of an atlas by folder ("run/0", "run/1" -> "run") in frame lists, ready for the animated sprites.
+	"""
+	animations = {}
+	for name in sorted(atlas.keys(),key=_natural_key):
+		folder = name.rsplit("/",1)[0] if "/" in name else ""
+		animations.setdefault(folder,[]).append(atlas[name])
+	return animations
+
+def pack_atlas(folder_path:str,image_path:str,index_path:str=None,padding:int=1,max_width:int=2048)->Dict[str,pygame.Rect]:
+	"""
+	Pack every image of a folder (and subfolders) in a single atlas image and save it with a JSON index, to load them at once with 'load_atlas'.
+
+	The image names are their paths inside the folder without extension, like "run/0". Return the region of every image.
+	"""
+	images = {}
+	for folder,_,image_files in walk(folder_path):
+		for image in image_files:
+			try:
+				surface = pygame.image.load(join(folder,image))
+			except pygame.error:
+				continue
+			images[splitext(relpath(join(folder,image),folder_path))[0].replace("\\","/")] = surface
+
+	# shelf packing, tallest images first
+	regions = {}
+	x = y = shelf_height = atlas_width = 0
+	for name in sorted(images.keys(),key=lambda name:(-images[name].get_height(),name)):
+		width,height = images[name].get_size()
+		if x > 0 and x+width > max_width:
+			x = 0
+			y += shelf_height+padding
+			shelf_height = 0
+		regions[name] = pygame.Rect(x,y,width,height)
+		x += width+padding
+		shelf_height = max(shelf_height,height)
+		atlas_width = max(atlas_width,x-padding)
+
+	atlas = pygame.Surface((max(atlas_width,1),max(y+shelf_height,1)),pygame.SRCALPHA)
+	for name,region in regions.items():
+		atlas.blit(images[name],region)
+	pygame.image.save(atlas,image_path)
+	if not index_path:
+		index_path = splitext(image_path)[0]+".json"
+	with open(index_path,"w") as file:
+		json.dump({"frames":{name:{"frame":{"x":r.x,"y":r.y,"w":r.w,"h":r.h}} for name,r in regions.items()}},file)
+	return regions
+
+def _natural_key(name:str)->list:
+	return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)",name)]
+
 # PIXEL CALCULATOR
 def width_calculator(your_window_width:int,desired_result:Union[int,float],rounded:bool=False)->Union[int,float]:
 	"""
@@ -118,13 +313,35 @@ def medium_calculator(your_window_width:int,your_window_height:int,desired_resul
 		return pixels
 
 # WINDOW
-def update_window(clock:pygame.time.Clock,desired_fps:int,window_surface:pygame.Surface=None,fill_color:Union[str,Tuple[int,int,int]]="black")->None:
-	"""Update the window and fill it after using the clock and pygame."""
+def update_window(clock:pygame.time.Clock,desired_fps:int,window_surface:pygame.Surface=None,fill_color:Union[str,Tuple[int,int,int]]="black",dirty_rects:List[pygame.Rect]=None)->None:
+	"""
+	Update the window and fill it after using the clock and pygame.
+
+	If 'dirty_rects' is passed (like the ones returned by 'DirtyGroup.draw') only those areas are updated, merged, and the window is not filled.
+	"""
 	clock.tick(desired_fps)
+	if dirty_rects is not None:
+		pygame.display.update(merge_rects(dirty_rects))
+		return
 	pygame.display.flip()
 	if window_surface:
 		window_surface.fill(fill_color)
 
+def merge_rects(rects:List[pygame.Rect])->List[pygame.Rect]:
+	"""
+	Return the rects with the overlapping ones joined, so every area is updated once.
+	"""
+	merged = []
+	for rect in sorted((pygame.Rect(rect) for rect in rects),key=lambda rect:rect.x):
+		if rect.w <= 0 or rect.h <= 0:
+			continue
+		index = rect.collidelist(merged)
+		while index != -1:
+			rect.union_ip(merged.pop(index))
+			index = rect.collidelist(merged)
+		merged.append(rect)
+	return merged
+
 def resize_window(current_surface,resized_window_sizes,resizable=True,flag=0):
     """
     Resize the window surface and blit the old one on it. Useful after the VIDEORESIZE event.
@@ -1,8 +1,12 @@
-import pygame
+import pygame, math, weakref, bisect
 from pygame_helper.graphics import *
 from typing import Union, Tuple,List, Dict,Any,Type
 # pygame shortcuts
 from pygame.sprite import GroupSingle,spritecollide,spritecollideany
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 """
 This module contains some helpful sprites based on the pygame one.
@@ -16,9 +20,12 @@ class Sprite(pygame.sprite.Sprite):
     A sprite class with the addition of useful methods and attributes.
     """
     def __init__(self,image:pygame.Surface=None,topleft_pos:Tuple[int,int]=None,groups:Union[pygame.sprite.Group,List[pygame.sprite.Group]]=[],direction:Tuple[int,int]=(0,0),speed:Tuple[float,float]=(0,0),z_index:int=0,parent=None,parent_offset:Tuple[int,int]=(0,0)):
-        super().__init__(groups)
+        # the groups with a 'move' method, told when the sprite moves
+        self._spatial_groups = []
+        super().__init__()
 
-        self.z_index = z_index
+        # set before joining the groups, they read it to choose the layer
+        self._z_index = z_index
 
         self.direction = pygame.math.Vector2(direction)
         self.speed = pygame.math.Vector2(speed)
@@ -32,9 +39,17 @@ class Sprite(pygame.sprite.Sprite):
                 self.refresh_position()
             self.original_image = self.image
                 
+        self.children = []
+        self._parent = None
+        # parent position and offset at the last propagation
+        self._parent_anchor = pygame.math.Vector2(math.nan,math.nan)
+        self._parent_anchor_offset = pygame.math.Vector2()
         self.parent = parent
         self.parent_offset = pygame.math.Vector2(parent_offset)
 
+        # added last, so the groups see the rect and hitbox
+        self.add(groups)
+
     def set_original_image(self):
         self.original_image = self.image
 
@@ -48,13 +63,15 @@ class Sprite(pygame.sprite.Sprite):
         """
         Return an exact copy of the sprite (note: only built in attributes are copied).
         """
-        new = Sprite(groups=self.groups(),z_index=self.z_index,direction=self.direction.xy,speed=self.speed.xy,position= self.position.xy)
+        new = Sprite(z_index=self.z_index,direction=self.direction.xy,speed=self.speed.xy)
+        new.position.xy = self.position.xy
         if hasattr(self,"rect"):
             new.rect = self.rect.copy()
         if hasattr(self, "hitbox"):
             new.hitbox = self.hitbox.copy()
         if hasattr(self,"image"):
             new.image = self.image
+        new.add(self.groups())
         return new
 
     def to_json(self,ignore_attributes:list=[])->dict:
@@ -143,10 +160,12 @@ class Sprite(pygame.sprite.Sprite):
             return True
         return False
 
-    def check_collision(self,sprite):
+    def check_collision(self,sprite,pixel_perfect:bool=False):
         """
-        Check the collision with another sprite.
+        Check the collision with another sprite. With 'pixel_perfect' the images are compared with 'mask_collide'.
         """
+        if pixel_perfect:
+            return mask_collide(self,sprite)
         return self.rect.colliderect(sprite.rect)
 
     def mouse_collision(self):
@@ -176,6 +195,7 @@ class Sprite(pygame.sprite.Sprite):
             self.position.y += self.direction.y*self.speed.y*dt
             self.rect.centery = round(self.position.y)
             self.hitbox.centery = self.rect.centery
+        self._notify_moved()
 
     def update_positions(self,dt=1):
         """
@@ -184,6 +204,65 @@ class Sprite(pygame.sprite.Sprite):
         self.update_position("h",dt)
         self.update_position("v",dt)
 
+    def update_positions_swept(self,collision_group,dt=1,slide:bool=True)->List[Tuple[pygame.sprite.Sprite,pygame.math.Vector2]]:
+        """
+        Move the sprite like 'update_positions', but stop it where its hitbox touches the hitbox of a sprite in the group, even if it would jump over it (swept AABB).
+
+        With 'slide' the rest of the movement continues along the wall. Return a list of (sprite hit, contact normal).
+        """
+        move_x = self.direction.x*self.speed.x*dt
+        move_y = self.direction.y*self.speed.y*dt
+        contacts = []
+        for _ in range(3 if slide else 1):
+            if move_x == 0 and move_y == 0:
+                break
+            box = (self.position.x-self.hitbox.w//2,self.position.y-self.hitbox.h//2,self.hitbox.w,self.hitbox.h)
+            area = self.hitbox.union(self.hitbox.move(move_x,move_y)).inflate(2,2)
+            candidates = collision_group.query(area) if hasattr(collision_group,"query") else collision_group.sprites()
+            first = None
+            for sprite in candidates:
+                if sprite is not self and hasattr(sprite,"hitbox"):
+                    hit = swept_aabb(box,(move_x,move_y),sprite.hitbox)
+                    if hit and (not first or hit[0] < first[0][0]):
+                        first = (hit,sprite)
+            if not first:
+                self.position.x += move_x
+                self.position.y += move_y
+                break
+            (time,normal_x,normal_y),sprite = first
+            self.position.x += move_x*time
+            self.position.y += move_y*time
+            contacts.append((sprite,pygame.math.Vector2(normal_x,normal_y)))
+            if not slide:
+                break
+            move_x *= 1-time
+            move_y *= 1-time
+            if normal_x:
+                move_x = 0
+            if normal_y:
+                move_y = 0
+        self.rect.center = (round(self.position.x),round(self.position.y))
+        self.hitbox.center = self.rect.center
+        self._notify_moved()
+        return contacts
+
+    def add_internal(self,group):
+        super().add_internal(group)
+        if hasattr(group,"move"):
+            self._spatial_groups.append(group)
+
+    def remove_internal(self,group):
+        super().remove_internal(group)
+        if group in self._spatial_groups:
+            self._spatial_groups.remove(group)
+
+    def _notify_moved(self):
+        """
+        Update the cells of the spatial groups the sprite is in, after it moved.
+        """
+        for group in self._spatial_groups:
+            group.move(self)
+
     def normalize_direction(self):
         """
         Normalize the direction of the sprite.
@@ -199,9 +278,18 @@ class Sprite(pygame.sprite.Sprite):
 
         You have to specify in which direction to check collisions, Otherwise, use 'collsions'.
         """
-        for sprite in collision_group.sprites():
+        if isinstance(collision_group,TileCollisionMap):
+            collision_group.resolve(self,direction)
+            return
+        if hasattr(collision_group,"iter_query"):
+            sprites = collision_group.iter_query(self.hitbox)
+        else:
+            sprites = collision_group.sprites()
+        pushed = False
+        for sprite in sprites:
             if hasattr(sprite, "hitbox"):
                 if sprite.hitbox.colliderect(self.hitbox):
+                    pushed = True
                     if direction == "horizontal" or direction == "h":
                         if self.direction.x > 0:
                             self.hitbox.right = sprite.hitbox.left
@@ -217,6 +305,8 @@ class Sprite(pygame.sprite.Sprite):
                             self.hitbox.top = sprite.hitbox.bottom
                         self.rect.centery = self.hitbox.centery
                         self.position.y = self.hitbox.centery
+        if pushed:
+            self._notify_moved()
 
     def collisions(self,collision_group):
         """
@@ -230,6 +320,7 @@ class Sprite(pygame.sprite.Sprite):
         Resize the rect to the image size, keeping the position. Useful after changing image.
         """
         self.rect = self.image.get_rect(center=self.rect.center)
+        self._notify_moved()
 
     def scale(self,scale:float=None,sizes:tuple=None,smooth:bool=False)->pygame.Surface:
         """
@@ -247,20 +338,215 @@ class Sprite(pygame.sprite.Sprite):
         self.resize_rect()
         return self.image
 
-    def rotate(self,angle:int):
+    def rotate(self,angle:int,cached:bool=False,smooth:bool=False):
         """
         Rotate the sprite and resize the rect.
+
+        With 'cached' the rotation is shared with every other sprite using the same image (check 'cached_rotate').
         """
-        self.image = pygame.transform.rotate(self.original_image, angle)
+        if cached:
+            self.image = cached_rotate(self.original_image,angle,smooth)
+        elif smooth:
+            self.image = pygame.transform.rotozoom(self.original_image,angle,1)
+        else:
+            self.image = pygame.transform.rotate(self.original_image, angle)
         self.resize_rect()
         return self.image
 
+    @property
+    def z_index(self)->int:
+        """
+        Setting the z_index moves the sprite to the new layer in its groups.
+        """
+        return self._z_index
+
+    @z_index.setter
+    def z_index(self,z_index:int):
+        self._z_index = z_index
+        try:
+            groups = self.groups()
+        except AttributeError:
+            # set by a subclass before 'super().__init__()', it isn't in any group yet
+            return
+        for group in groups:
+            if hasattr(group,"refresh_z_index"):
+                group.refresh_z_index(self)
+
+    @property
+    def parent(self):
+        """
+        Setting the parent adds the sprite to the parent children, used by 'propagate_transforms'.
+        """
+        return self._parent
+
+    @parent.setter
+    def parent(self,parent):
+        if parent is self._parent:
+            return
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is self:
+                raise ValueError("A sprite can't be a parent of one of its parents.")
+            ancestor = getattr(ancestor,"parent",None)
+        if self._parent is not None and hasattr(self._parent,"children"):
+            self._parent.children.remove(self)
+        self._parent = parent
+        if parent is not None and hasattr(parent,"children"):
+            parent.children.append(self)
+        self._parent_anchor.update(math.nan,math.nan)
+
     def stick_to_parent(self):
         """
         Set its position to the parent position offsetted.
         """
         if self.parent:
-            self.position = self.parent_offset+self.parent.position
+            self.position.update(self.parent.position)
+            self.position += self.parent_offset
+
+    def propagate_transforms(self)->None:
+        """
+        Move the children, and their children, to their parent position offsetted, updating position, rect and hitbox.
+
+        The parents are always moved before their children. A child whose parent and offset didn't change since the last call isn't updated, but its children are still checked, since their offsets may have changed.
+        """
+        stack = self.children[::-1]
+        while stack:
+            child = stack.pop()
+            stack.extend(reversed(child.children))
+            parent_position,offset,anchor,anchor_offset = child._parent.position,child.parent_offset,child._parent_anchor,child._parent_anchor_offset
+            if parent_position.x == anchor.x and parent_position.y == anchor.y and offset.x == anchor_offset.x and offset.y == anchor_offset.y:
+                continue
+            anchor.update(parent_position)
+            anchor_offset.update(offset)
+            position = child.position
+            position.update(parent_position)
+            position += offset
+            if hasattr(child,"rect"):
+                child.rect.centerx = round(position.x)
+                child.rect.centery = round(position.y)
+                if hasattr(child,"hitbox"):
+                    child.hitbox.centerx = child.rect.centerx
+                    child.hitbox.centery = child.rect.centery
+                child._notify_moved()
+
+class LightSprite():
+    """
+    A lighter sprite for big amounts of simple entities like bullets: it uses __slots__ and floats instead of vectors, and the hitbox is the rect itself unless 'set_hitbox' is called.
+
+    It's not a pygame sprite subclass but it works with the groups, the camera group and the collision helpers.
+    """
+    __slots__ = ("image","rect","hitbox","x","y","direction_x","direction_y","speed_x","speed_y","_z_index","_groups","__weakref__")
+
+    def __init__(self,image:pygame.Surface,topleft_pos:Tuple[int,int]=(0,0),groups:Union[pygame.sprite.Group,List[pygame.sprite.Group]]=[],direction:Tuple[float,float]=(0,0),speed:Tuple[float,float]=(0,0),z_index:int=0):
+        self._groups = {}
+        self.image = image
+        self.rect = image.get_rect(topleft=topleft_pos)
+        self.hitbox = self.rect
+        self.x,self.y = self.rect.center
+        self.direction_x,self.direction_y = direction
+        self.speed_x,self.speed_y = speed
+        self._z_index = z_index
+        self.add(groups)
+
+    def __repr__(self):
+        return f"<LightSprite(in {len(self._groups)} groups)>"
+
+    @property
+    def z_index(self)->int:
+        """
+        Setting the z_index moves the sprite to the new layer in its groups.
+        """
+        return self._z_index
+
+    @z_index.setter
+    def z_index(self,z_index:int):
+        self._z_index = z_index
+        for group in self._groups:
+            if hasattr(group,"refresh_z_index"):
+                group.refresh_z_index(self)
+
+    # pygame sprite protocol
+    def add(self,*groups):
+        for group in groups:
+            if hasattr(group,"_spritegroup"):
+                if group not in self._groups:
+                    group.add_internal(self)
+                    self.add_internal(group)
+            else:
+                self.add(*group)
+
+    def remove(self,*groups):
+        for group in groups:
+            if hasattr(group,"_spritegroup"):
+                if group in self._groups:
+                    group.remove_internal(self)
+                    self.remove_internal(group)
+            else:
+                self.remove(*group)
+
+    def add_internal(self,group):
+        # True for the groups to tell when the sprite moves
+        self._groups[group] = hasattr(group,"move")
+
+    def remove_internal(self,group):
+        del self._groups[group]
+
+    def update(self,*args,**kwargs):
+        pass
+
+    def kill(self):
+        for group in list(self._groups):
+            group.remove_internal(self)
+        self._groups.clear()
+
+    def groups(self)->list:
+        return list(self._groups)
+
+    def alive(self)->bool:
+        return bool(self._groups)
+
+    # helper methods
+    def set_hitbox(self,hitbox_inflate:Tuple[int,int]=(0,0))->pygame.Rect:
+        """
+        Give the sprite its own hitbox, inflated from the rect.
+        """
+        self.hitbox = self.rect.inflate(hitbox_inflate[0],hitbox_inflate[1])
+        return self.hitbox
+
+    def draw(self,surface:pygame.Surface)->None:
+        surface.blit(self.image,self.rect)
+
+    def update_positions(self,dt=1):
+        """
+        Move the sprite using its speed and direction.
+        """
+        self.x += self.direction_x*self.speed_x*dt
+        self.y += self.direction_y*self.speed_y*dt
+        center = (round(self.x),round(self.y))
+        self.rect.center = center
+        if self.hitbox is not self.rect:
+            self.hitbox.center = center
+        self._notify_moved()
+
+    def _notify_moved(self):
+        for group,spatial in self._groups.items():
+            if spatial:
+                group.move(self)
+
+    def collisions(self,collision_group):
+        """
+        Push the sprite out of the hitboxes of a group (or the tiles of a 'TileCollisionMap'), like 'Sprite.collisions' but checking both axis at once: every hitbox pushes it only on the axis where it entered the least.
+        """
+        if isinstance(collision_group,TileCollisionMap):
+            collision_group.resolve(self)
+            return
+        sprites = collision_group.iter_query(self.hitbox) if hasattr(collision_group,"iter_query") else collision_group.sprites()
+        for sprite in sprites:
+            if sprite is not self and hasattr(sprite,"hitbox") and sprite.hitbox.colliderect(self.hitbox):
+                _push_out(self.hitbox,sprite.hitbox,self.direction_x,self.direction_y)
+                self.rect.center = self.hitbox.center
+                self.x,self.y = self.hitbox.center
+                self._notify_moved()
 
 class SimpleAnimatedSprite(Sprite):
     """
@@ -278,23 +564,23 @@ class SimpleAnimatedSprite(Sprite):
 
     def scale(self,scale:float=None,scale_sizes:Tuple[int,int]=None,smooth:bool=False):
         """
-        Scale the sprite.
+        Scale the sprite. The scaled frames are shared with the other sprites scaling the same frames (do not modify them, use 'set_frames').
         """
-        self.frames = [scale_image(frame,scale,scale_sizes,smooth) for frame in self.frames]
+        self._set_shared_frames(frame_set_registry.get(self.frames,("scale",scale,scale_sizes,smooth),self))
         return self.frames
 
     def flip(self,horizontal:bool,vertical:bool)->pygame.Surface:
         """
-        Flip the sprite.
+        Flip the sprite. The flipped frames are shared like the scaled ones.
         """
-        self.frames = [pygame.transform.flip(frame,horizontal,vertical) for frame in self.frames]
+        self._set_shared_frames(frame_set_registry.get(self.frames,("flip",horizontal,vertical),self))
         return self.frames
 
     def rotate(self,angle:int):
         """
-        Rotate the sprite.
+        Rotate the sprite. The rotated frames are shared like the scaled ones.
         """
-        self.frames = [pygame.transform.rotate(frame,angle) for frame in self.original_frames]
+        self._set_shared_frames(frame_set_registry.get(self.original_frames,("rotate",angle),self))
         return self.frames
 
     def refresh_frames(self):
@@ -307,14 +593,20 @@ class SimpleAnimatedSprite(Sprite):
         """
         Set the frames and refresh them.
         """
+        frame_set_registry.release(self.frames,self)
         self.frames = frames
         self.original_frames = self.frames
 
+    def _set_shared_frames(self,frames):
+        frame_set_registry.release(self.frames,self)
+        self.frames = frames
+
     def copy(self):
         """
         Return an exact copy of the sprite (note: only built in attributes are copied).
         """
-        new = SimpleAnimatedSprite(frames=self.frames,groups=self.groups(),z_index=self.z_index,direction=self.direction.xy,speed=self.speed.xy,position= self.position.xy)
+        new = SimpleAnimatedSprite(frames=self.frames,z_index=self.z_index,direction=self.direction.xy,speed=self.speed.xy)
+        new.position.xy = self.position.xy
         if hasattr(self,"rect"):
             new.rect = self.rect.copy()
         if hasattr(self, "hitbox"):
@@ -322,6 +614,7 @@ class SimpleAnimatedSprite(Sprite):
         new.image = self.image
         new.frame_index = self.frame_index
         new.frame_speed = self.frame_speed
+        new.add(self.groups())
         return new
 
     def to_json(self,ignore_attributes:list=[])->dict:
@@ -392,25 +685,29 @@ class AnimatedSprite(Sprite):
 
     def scale(self,scale:float=None,scale_sizes:Tuple[int,int]=None,smooth:bool=False):
         """
-        Scale the sprite.
+        Scale the sprite. The scaled animations are shared with the other sprites scaling the same animations (do not modify them, use 'set_animations').
         """
-        self.animations = {name:[scale_image(frame,scale,scale_sizes,smooth) for frame in frames] for name,frames in self.animations}
+        self._set_shared_animations(frame_set_registry.get(self.animations,("scale",scale,scale_sizes,smooth),self))
         return self.animations
 
     def flip(self,horizontal:bool,vertical:bool)->pygame.Surface:
         """
-        Flip the sprite.
+        Flip the sprite. The flipped animations are shared like the scaled ones.
         """
-        self.animations = {name:[pygame.transform.flip(frame,horizontal,vertical) for frame in frames] for name,frames in self.animations}
+        self._set_shared_animations(frame_set_registry.get(self.animations,("flip",horizontal,vertical),self))
         return self.animations
 
     def rotate(self,angle:int):
         """
-        Rotate the sprite.
+        Rotate the sprite. The rotated animations are shared like the scaled ones.
         """
-        self.animations = {name:[pygame.transform.rotate(frame,angle) for frame in frames] for name,frames in self.original_animations}
+        self._set_shared_animations(frame_set_registry.get(self.original_animations,("rotate",angle),self))
         return self.animations
 
+    def _set_shared_animations(self,animations):
+        frame_set_registry.release(self.animations,self)
+        self.animations = animations
+
     def refresh_animations(self):
         """
         Call if you change a frame in the animations.
@@ -421,6 +718,7 @@ class AnimatedSprite(Sprite):
         """
         Set the animations.
         """
+        frame_set_registry.release(self.animations,self)
         self.animations = animations_dict
         self.original_animations = self.animations
 
@@ -428,7 +726,8 @@ class AnimatedSprite(Sprite):
         """
         Return an exact copy of the sprite (note: only built in attributes are copied).
         """
-        new = AnimatedSprite(self.animations,self.current_animation,groups=self.groups(),z_index=self.z_index,direction=self.direction.xy,speed=self.speed.xy,position= self.position.xy)
+        new = AnimatedSprite(self.animations,self.current_animation,z_index=self.z_index,direction=self.direction.xy,speed=self.speed.xy)
+        new.position.xy = self.position.xy
         if hasattr(self,"rect"):
             new.rect = self.rect.copy()
         if hasattr(self, "hitbox"):
@@ -436,6 +735,7 @@ class AnimatedSprite(Sprite):
         new.image = self.image
         new.frame_index = self.frame_index
         new.frame_speed = self.frame_speed
+        new.add(self.groups())
         return new
 
     def to_json(self,ignore_attributes:list=[])->dict:
@@ -488,14 +788,500 @@ class AnimatedSprite(Sprite):
         if resize_rect:
             self.resize_rect()
 
+# FRAME SETS
+class FrameSetRegistry():
+    """
+    Give out transformed (scaled, flipped, rotated) versions of frame lists or animation dicts, made once and shared by every sprite asking for the same one.
+
+    A frame set lives while a sprite uses it (sprites are referenced weakly) or while a set made from it is alive. The animated sprites use the 'frame_set_registry' instance.
+    """
+    def __init__(self):
+        self._sets = {}
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._sets)
+
+    def get(self,frames:Union[List[pygame.Surface],Dict[str,List[pygame.Surface]]],operation:tuple,owner=None):
+        """
+        Return the frames transformed by an operation: ("scale",scale,sizes,smooth), ("flip",horizontal,vertical) or ("rotate",angle).
+
+        The owner is registered as a user of the result until 'release' is called or it's garbage collected.
+        """
+        # sizes can be lists or vectors, they need to be hashable in the key
+        operation = tuple(tuple(value) if isinstance(value,(list,pygame.math.Vector2)) else value for value in operation)
+        key = (id(frames),operation)
+        entry = self._sets.get(key)
+        if not entry or entry["source"] is not frames:
+            self._collect()
+            entry = {"frames":self._transform(frames,operation),"source":frames,"owners":weakref.WeakSet(),"dependants":0}
+            self._sets[key] = entry
+            self._keys[id(entry["frames"])] = key
+            parent = self._entry(frames)
+            if parent:
+                parent["dependants"] += 1
+        if owner is not None:
+            entry["owners"].add(owner)
+        return entry["frames"]
+
+    def release(self,frames,owner=None)->None:
+        """
+        Tell the registry that the owner doesn't use these frames anymore. Frames not made by the registry are ignored.
+        """
+        entry = self._entry(frames)
+        if entry:
+            if owner is not None:
+                entry["owners"].discard(owner)
+            self._drop_unused(frames)
+
+    def clear(self)->None:
+        self._sets.clear()
+        self._keys.clear()
+
+    def _entry(self,frames)->dict:
+        key = self._keys.get(id(frames))
+        if key:
+            entry = self._sets.get(key)
+            if entry and entry["frames"] is frames:
+                return entry
+        return None
+
+    def _drop_unused(self,frames):
+        """
+        Remove a set (and then its source set) if nothing uses it.
+        """
+        entry = self._entry(frames)
+        while entry and not entry["owners"] and entry["dependants"] == 0:
+            key = self._keys.pop(id(entry["frames"]))
+            del self._sets[key]
+            entry = self._entry(entry["source"])
+            if entry:
+                entry["dependants"] -= 1
+
+    def _collect(self):
+        """
+        Remove the sets whose owners were all garbage collected.
+        """
+        for entry in list(self._sets.values()):
+            if not entry["owners"] and entry["dependants"] == 0:
+                self._drop_unused(entry["frames"])
+
+    def _transform(self,frames,operation:tuple):
+        if isinstance(frames,dict):
+            return {name:self._transform(animation,operation) for name,animation in frames.items()}
+        if operation[0] == "scale":
+            return [scale_image(frame,operation[1],operation[2],operation[3]) for frame in frames]
+        if operation[0] == "flip":
+            return [pygame.transform.flip(frame,operation[1],operation[2]) for frame in frames]
+        if operation[0] == "rotate":
+            return [pygame.transform.rotate(frame,operation[1]) for frame in frames]
+        raise ValueError(f"Unknown frames operation '{operation[0]}'.")
+
+frame_set_registry = FrameSetRegistry()
+
+# COLLISION UTILS
+def _push_out(box:pygame.Rect,target:pygame.Rect,direction_x:float,direction_y:float,horizontal:bool=True,vertical:bool=True)->None:
+    """
+    Move the box out of the target against its direction. With both axis only the one with the smallest penetration is used, so touching one face doesn't snap the box to the other.
+    """
+    penetration_x = penetration_y = math.inf
+    if horizontal and direction_x:
+        penetration_x = box.right-target.left if direction_x > 0 else target.right-box.left
+    if vertical and direction_y:
+        penetration_y = box.bottom-target.top if direction_y > 0 else target.bottom-box.top
+    if penetration_x == penetration_y == math.inf:
+        return
+    if penetration_x <= penetration_y:
+        if direction_x > 0:
+            box.right = target.left
+        else:
+            box.left = target.right
+    elif direction_y > 0:
+        box.bottom = target.top
+    else:
+        box.top = target.bottom
+
+def swept_aabb(box:Union[pygame.Rect,Tuple[float,float,float,float]],motion:Tuple[float,float],target:pygame.Rect)->Tuple[float,int,int]:
+    """
+    Return when (from 0 to 1 of the motion) a moving box hits a still rect, with the contact normal: (time,normal_x,normal_y).
+
+    Return None if they don't hit during the motion or if they already overlap.
+    """
+    x,y,w,h = box
+    move_x,move_y = motion
+    if move_x > 0:
+        entry_x,exit_x = (target.left-(x+w))/move_x,(target.right-x)/move_x
+    elif move_x < 0:
+        entry_x,exit_x = (target.right-x)/move_x,(target.left-(x+w))/move_x
+    elif x+w <= target.left or x >= target.right:
+        return None
+    else:
+        entry_x,exit_x = -math.inf,math.inf
+    if move_y > 0:
+        entry_y,exit_y = (target.top-(y+h))/move_y,(target.bottom-y)/move_y
+    elif move_y < 0:
+        entry_y,exit_y = (target.bottom-y)/move_y,(target.top-(y+h))/move_y
+    elif y+h <= target.top or y >= target.bottom:
+        return None
+    else:
+        entry_y,exit_y = -math.inf,math.inf
+
+    entry = max(entry_x,entry_y)
+    if entry > min(exit_x,exit_y) or entry < 0 or entry > 1:
+        return None
+    if entry_x > entry_y:
+        return entry,-1 if move_x > 0 else 1,0
+    return entry,0,-1 if move_y > 0 else 1
+
+def mask_collide(sprite_a,sprite_b)->bool:
+    """
+    Return True if the visible pixels of the sprite images touch. The hitboxes (or rects) are checked first, the cached masks only if they collide.
+
+    Can be used as the 'collided' function of the pygame collision functions.
+    """
+    box_a = getattr(sprite_a,"hitbox",sprite_a.rect)
+    box_b = getattr(sprite_b,"hitbox",sprite_b.rect)
+    if not box_a.colliderect(box_b) or not sprite_a.rect.colliderect(sprite_b.rect):
+        return False
+    offset = (sprite_b.rect.x-sprite_a.rect.x,sprite_b.rect.y-sprite_a.rect.y)
+    return get_mask(sprite_a.image).overlap(get_mask(sprite_b.image),offset) is not None
+
+def groupcollide_mask(group_a:pygame.sprite.Group,group_b:pygame.sprite.Group,dokilla:bool=False,dokillb:bool=False)->Dict[pygame.sprite.Sprite,List[pygame.sprite.Sprite]]:
+    """
+    Like 'pygame.sprite.groupcollide' with pixel perfect collisions: return a dict of the sprites of group_a with the list of the group_b sprites they touch.
+
+    If group_b is a 'SpatialHashGroup' only the sprites near each sprite are checked.
+    """
+    collisions = {}
+    for sprite in group_a.sprites():
+        if hasattr(group_b,"query"):
+            near = group_b.query(getattr(sprite,"hitbox",sprite.rect))
+        else:
+            near = group_b.sprites()
+        touching = [other for other in near if mask_collide(sprite,other)]
+        if touching:
+            collisions[sprite] = touching
+            # killed right away, so the next sprites don't see them like in groupcollide
+            if dokillb:
+                for other in touching:
+                    other.kill()
+            if dokilla:
+                sprite.kill()
+    return collisions
+
+class SweepAndPrune():
+    """
+    Find the sprites of two groups whose rects overlap by sorting them on the x axis and sweeping the sorted list.
+
+    The order is kept between calls and sorted again every time, which is almost free when the sprites moved a little. Use one for every pair of groups.
+    """
+    def __init__(self):
+        # (sprite, 0 for group a or 1 for group b)
+        self._entries = []
+
+    def pairs(self,group_a:pygame.sprite.Group,group_b:pygame.sprite.Group):
+        """
+        Yield the (sprite of group_a, sprite of group_b) pairs whose rects overlap.
+        """
+        members = (group_a.spritedict,group_b.spritedict)
+        entries = [entry for entry in self._entries if entry[0] in members[entry[1]]]
+        if len(entries) != len(members[0])+len(members[1]):
+            known = set(entries)
+            entries.extend((sprite,0) for sprite in members[0] if (sprite,0) not in known)
+            entries.extend((sprite,1) for sprite in members[1] if (sprite,1) not in known)
+        entries.sort(key=lambda entry:entry[0].rect.left)
+        self._entries = entries
+
+        active = ([],[])
+        for sprite,side in entries:
+            rect = sprite.rect
+            left,top,bottom = rect.left,rect.top,rect.bottom
+            others = active[1-side]
+            kept = []
+            for other in others:
+                other_rect = other.rect
+                if other_rect.right > left:
+                    kept.append(other)
+                    if other_rect.top < bottom and top < other_rect.bottom:
+                        yield (other,sprite) if side else (sprite,other)
+            others[:] = kept
+            active[side].append(sprite)
+
+    def clear(self)->None:
+        """
+        Forget the sorted order.
+        """
+        self._entries.clear()
+
+def collide_groups(group_a:pygame.sprite.Group,group_b:pygame.sprite.Group,dokilla:bool=False,dokillb:bool=False,collided=None,sweep:SweepAndPrune=None)->Dict[pygame.sprite.Sprite,List[pygame.sprite.Sprite]]:
+    """
+    Return the same dict of 'pygame.sprite.groupcollide' (killing the sprites the same way) using a sweep and prune broadphase on the rects.
+
+    'collided' is called only for the pairs with overlapping rects, so it must not detect collisions outside them (like 'collide_mask' or 'mask_collide'). Pass the same 'sweep' every frame to reuse the sorted order.
+    """
+    if sweep is None:
+        sweep = SweepAndPrune()
+    found = {}
+    for sprite,other in sweep.pairs(group_a,group_b):
+        if collided is None or collided(sprite,other):
+            found.setdefault(sprite,[]).append(other)
+    if not found:
+        return {}
+
+    order_b = {sprite:index for index,sprite in enumerate(group_b.sprites())}
+    killed = set()
+    collisions = {}
+    for sprite in group_a.sprites():
+        if sprite not in found:
+            continue
+        touching = sorted(found[sprite],key=order_b.__getitem__)
+        if killed:
+            touching = [other for other in touching if other not in killed]
+        if not touching:
+            continue
+        collisions[sprite] = touching
+        if dokillb:
+            for other in touching:
+                other.kill()
+            killed.update(touching)
+        if dokilla:
+            sprite.kill()
+            killed.add(sprite)
+    return collisions
+
+class ContactTracker():
+    """
+    Remember which sprites of two groups are touching between frames, to know when a contact starts (enter), continues (stay) and ends (exit).
+
+    The callbacks are called with (sprite_a, sprite_b). If 'event_type' is given an event with 'contact' ("enter", "stay", "exit"), 'sprite_a' and 'sprite_b' is also posted ("stay" events only with 'post_stay').
+    """
+    def __init__(self,group_a:pygame.sprite.Group,group_b:pygame.sprite.Group,collided=None,on_enter=None,on_stay=None,on_exit=None,event_type:int=None,post_stay:bool=False):
+        self.group_a = group_a
+        self.group_b = group_b
+        self.collided = collided
+        self.on_enter = on_enter
+        self.on_stay = on_stay
+        self.on_exit = on_exit
+        self.event_type = event_type
+        self.post_stay = post_stay
+        self.sweep = SweepAndPrune()
+        # (id a, id b): [sprite a, sprite b, rect a, rect b, image a, image b, touching]
+        self._contacts = {}
+
+    def update(self)->None:
+        """
+        Find the touching pairs and call the callbacks. The 'collided' function runs only for the pairs that just started overlapping or whose rect or image changed.
+        """
+        contacts = self._contacts
+        seen = {}
+        for sprite,other in self.sweep.pairs(self.group_a,self.group_b):
+            key = (id(sprite),id(other))
+            rect,other_rect = sprite.rect,other.rect
+            contact = contacts.get(key)
+            if contact is None or contact[0] is not sprite or contact[1] is not other:
+                contact = [sprite,other,None,None,None,None,False]
+            was_touching = contact[6]
+            if contact[2] != rect or contact[3] != other_rect or contact[4] is not sprite.image or contact[5] is not other.image:
+                contact[2],contact[3] = tuple(rect),tuple(other_rect)
+                contact[4],contact[5] = sprite.image,other.image
+                contact[6] = self.collided is None or bool(self.collided(sprite,other))
+            seen[key] = contact
+            if contact[6]:
+                self._emit("stay" if was_touching else "enter",sprite,other)
+            elif was_touching:
+                self._emit("exit",sprite,other)
+
+        for key,contact in contacts.items():
+            if key not in seen and contact[6]:
+                self._emit("exit",contact[0],contact[1])
+        self._contacts = seen
+
+    def touching(self)->List[Tuple[pygame.sprite.Sprite,pygame.sprite.Sprite]]:
+        """
+        Return the pairs touching at the last update.
+        """
+        return [(contact[0],contact[1]) for contact in self._contacts.values() if contact[6]]
+
+    def is_touching(self,sprite_a,sprite_b)->bool:
+        """
+        Return True if the sprites were touching at the last update.
+        """
+        contact = self._contacts.get((id(sprite_a),id(sprite_b)))
+        return contact is not None and contact[6] and contact[0] is sprite_a and contact[1] is sprite_b
+
+    def clear(self)->None:
+        """
+        Forget the contacts without calling the exit callbacks.
+        """
+        self._contacts.clear()
+        self.sweep.clear()
+
+    def _emit(self,contact:str,sprite_a,sprite_b):
+        callback = self.on_enter if contact == "enter" else self.on_stay if contact == "stay" else self.on_exit
+        if callback:
+            callback(sprite_a,sprite_b)
+        if self.event_type is not None and (contact != "stay" or self.post_stay):
+            pygame.event.post(pygame.event.Event(self.event_type,contact=contact,sprite_a=sprite_a,sprite_b=sprite_b))
+
+class TileCollisionMap():
+    """
+    The solid tiles of a tile grid, to use as the collision group of 'Sprite.collision'/'collisions' instead of a wall sprite for every tile.
+
+    The matrix is a list of rows (like the 'PathFinder' one, where 0 is a wall), only the tiles under the hitbox are checked. The matrix isn't copied, changes to it are seen immediately.
+    """
+    def __init__(self,matrix:List[List[int]],cell_size:int,solid_value:int=0):
+        self.matrix = matrix
+        self.cell_size = cell_size
+        self.solid_value = solid_value
+        self.width = len(matrix[0]) if len(matrix) else 0
+        self.height = len(matrix)
+
+    @staticmethod
+    def from_pathfinder(pathfinder)->"TileCollisionMap":
+        """
+        Return a collision map sharing the matrix and cell size of a pathfinder. This is a static method, working as a second constructor.
+        """
+        return TileCollisionMap(pathfinder.matrix,pathfinder.cell_size,0)
+
+    def is_solid(self,column:int,row:int)->bool:
+        """
+        Return True if the tile is solid. Tiles outside the grid aren't.
+        """
+        return 0 <= column < self.width and 0 <= row < self.height and self.matrix[row][column] == self.solid_value
+
+    def tiles_in_rect(self,rect:pygame.Rect)->List[pygame.Rect]:
+        """
+        Return the rects of the solid tiles overlapped by the rect, row by row.
+        """
+        cell_size = self.cell_size
+        left,top = max(rect.left//cell_size,0),max(rect.top//cell_size,0)
+        right,bottom = min((rect.right-1)//cell_size,self.width-1),min((rect.bottom-1)//cell_size,self.height-1)
+        solid_value = self.solid_value
+        tiles = []
+        for row in range(top,bottom+1):
+            cells = self.matrix[row]
+            for column in range(left,right+1):
+                if cells[column] == solid_value:
+                    tiles.append(pygame.Rect(column*cell_size,row*cell_size,cell_size,cell_size))
+        return tiles
+
+    def resolve(self,sprite,direction:str="both")->bool:
+        """
+        Push the sprite hitbox out of the solid tiles against its direction, like the walls of 'Sprite.collision', then move its rect and position. Return True if it touched a tile.
+
+        The direction can be "horizontal"/"h", "vertical"/"v" or "both" (every tile pushes only on the axis where the sprite entered the least).
+        """
+        if hasattr(sprite,"direction"):
+            direction_x,direction_y = sprite.direction.x,sprite.direction.y
+        else:
+            direction_x,direction_y = sprite.direction_x,sprite.direction_y
+        horizontal = direction in ("both","horizontal","h")
+        vertical = direction in ("both","vertical","v")
+        hitbox = sprite.hitbox
+        touched = False
+        for tile in self.tiles_in_rect(hitbox):
+            if not tile.colliderect(hitbox):
+                continue
+            touched = True
+            _push_out(hitbox,tile,direction_x,direction_y,horizontal,vertical)
+        if touched:
+            if hasattr(sprite,"position"):
+                if horizontal:
+                    sprite.rect.centerx = hitbox.centerx
+                    sprite.position.x = hitbox.centerx
+                if vertical:
+                    sprite.rect.centery = hitbox.centery
+                    sprite.position.y = hitbox.centery
+            else:
+                sprite.rect.center = hitbox.center
+                sprite.x,sprite.y = hitbox.center
+            if hasattr(sprite,"_notify_moved"):
+                sprite._notify_moved()
+        return touched
+
 # GROUPS
 class Group(pygame.sprite.Group):
     """
     A pygame group that allows json serialization.
+
+    The sprites are also kept in one bucket per z_index, updated when they join, leave or change z_index, to iterate and draw them by layer without sorting.
     """
     def __init__(self):
+        # z_index: {sprite: None}, kept in the order the sprites were added
+        self._layers = {}
+        self._layer_order = []
+        self._sprite_layers = {}
         super().__init__()
 
+    def add_internal(self,sprite,layer=None):
+        super().add_internal(sprite,layer)
+        self._add_to_layer(sprite,getattr(sprite,"z_index",0))
+
+    def remove_internal(self,sprite):
+        super().remove_internal(sprite)
+        self._remove_from_layer(sprite)
+
+    def refresh_z_index(self,sprite)->None:
+        """
+        Move the sprite to the bucket of its current z_index. The helper sprites call it by themselves when their z_index is set.
+        """
+        if sprite in self._sprite_layers and self._sprite_layers[sprite] != sprite.z_index:
+            self._remove_from_layer(sprite)
+            self._add_to_layer(sprite,sprite.z_index)
+
+    def layers(self)->List[int]:
+        """
+        Return the z_index values of the sprites, from the lowest.
+        """
+        return list(self._layer_order)
+
+    def sprites_in_layer(self,z_index:int)->List[pygame.sprite.Sprite]:
+        """
+        Return the sprites with this z_index, in the order they were added.
+        """
+        return list(self._layers.get(z_index,()))
+
+    def iter_layers(self,z_min:int=None,z_max:int=None):
+        """
+        Yield the sprites from the lowest layer to the highest, only the layers between z_min and z_max (included) if given.
+        """
+        order = self._layer_order
+        start = 0 if z_min is None else bisect.bisect_left(order,z_min)
+        end = len(order) if z_max is None else bisect.bisect_right(order,z_max)
+        for z_index in order[start:end]:
+            yield from list(self._layers[z_index])
+
+    def draw_layers(self,surface:pygame.Surface,z_min:int=None,z_max:int=None)->None:
+        """
+        Draw the sprites layer by layer (between z_min and z_max if given) with one 'blits' call.
+        """
+        surface.blits([(sprite.image,sprite.rect) for sprite in self.iter_layers(z_min,z_max)],False)
+
+    def _add_to_layer(self,sprite,z_index:int):
+        self._sprite_layers[sprite] = z_index
+        if z_index not in self._layers:
+            self._layers[z_index] = {}
+            bisect.insort(self._layer_order,z_index)
+        self._layers[z_index][sprite] = None
+        self._layer_changed(z_index)
+
+    def _remove_from_layer(self,sprite):
+        z_index = self._sprite_layers.pop(sprite,None)
+        if z_index is None:
+            return
+        layer = self._layers[z_index]
+        del layer[sprite]
+        if not layer:
+            del self._layers[z_index]
+            self._layer_order.remove(z_index)
+        self._layer_changed(z_index)
+
+    def _layer_changed(self,z_index:int):
+        """
+        Called when a sprite joins or leaves a layer.
+        """
+        pass
+
     def to_json(self,ignore_attributes=[])->list:
         """
         Return a list of the serialized sprites using their own to_json methods.
@@ -521,27 +1307,712 @@ class Group(pygame.sprite.Group):
             else:
                 raise AttributeError("Sprites need to have the from_json method defined in order to be deserialized.")
 
+    def propagate_transforms(self)->None:
+        """
+        Call 'propagate_transforms' on the topmost parent of every sprite, once each.
+        """
+        roots = {}
+        for sprite in self.sprites():
+            while getattr(sprite,"parent",None) is not None:
+                sprite = sprite.parent
+            if getattr(sprite,"children",None):
+                roots[sprite] = None
+        for root in roots:
+            root.propagate_transforms()
+
 class CameraGroup(Group):
     """
     Very useful for games with a camera like Stardew Valley.
+
+    The layers set with 'set_static_layer' are baked in big chunk surfaces, so static ground tiles cost one blit per visible chunk.
     """
     def __init__(self):
-        super().__init__()
         self.offset = pygame.math.Vector2()
+        # z_index: sprites kept sorted by y between frames, so sorting them again is almost free
+        self._orders = {}
+        self._changed_layers = set()
+        # z_index: chunk size
+        self.static_layers = {}
+        # z_index: {chunk: surface}, {chunk: [sprites]}, {dirty chunks}
+        self._chunks = {}
+        self._chunk_sprites = {}
+        self._dirty_chunks = {}
+        # sprite: (z_index, chunks, insertion number)
+        self._static_sprites = {}
+        # static sprites that joined without a rect, put in their chunks at the next draw
+        self._pending_static = {}
+        self._counter = 0
+        super().__init__()
+
+    def add_internal(self,sprite,layer=None):
+        super().add_internal(sprite,layer)
+        if sprite.z_index in self.static_layers:
+            self._add_static(sprite)
+
+    def remove_internal(self,sprite):
+        super().remove_internal(sprite)
+        if sprite in self._static_sprites:
+            self._remove_static(sprite)
+
+    def refresh_z_index(self,sprite)->None:
+        if sprite in self._static_sprites:
+            self._remove_static(sprite)
+        super().refresh_z_index(sprite)
+        if sprite in self.spritedict and sprite.z_index in self.static_layers:
+            self._add_static(sprite)
+
+    def set_static_layer(self,z_index:int,chunk_size:int=512)->None:
+        """
+        Bake the sprites with this z_index (also the ones added later) in chunk surfaces of chunk_size x chunk_size pixels.
+
+        After changing the image or rect of a static sprite call 'mark_static_dirty'. The chunks have per pixel alpha, so semi transparent sprites are blended on a transparent chunk instead of on the screen.
+        """
+        self.remove_static_layer(z_index)
+        self.static_layers[z_index] = chunk_size
+        self._chunks[z_index] = {}
+        self._chunk_sprites[z_index] = {}
+        self._dirty_chunks[z_index] = set()
+        for sprite in self.sprites_in_layer(z_index):
+            self._add_static(sprite)
+
+    def remove_static_layer(self,z_index:int)->None:
+        """
+        Draw the sprites with this z_index one by one again.
+        """
+        if z_index not in self.static_layers:
+            return
+        for sprite in [sprite for sprite,(z,_,_) in self._static_sprites.items() if z == z_index]:
+            del self._static_sprites[sprite]
+        del self.static_layers[z_index],self._chunks[z_index],self._chunk_sprites[z_index],self._dirty_chunks[z_index]
+
+    def mark_static_dirty(self,sprite:Sprite=None)->None:
+        """
+        Re-bake the chunks of a static sprite that changed image or moved, or every chunk if no sprite is passed.
+        """
+        if sprite is None:
+            for z_index,chunks in self._chunk_sprites.items():
+                self._dirty_chunks[z_index].update(chunks.keys())
+                self._dirty_chunks[z_index].update(self._chunks[z_index].keys())
+        elif sprite in self._static_sprites:
+            order = self._static_sprites[sprite][2]
+            self._remove_static(sprite)
+            self._add_static(sprite,order)
 
-    def draw(self,screen:pygame.Surface,main_sprite:Sprite,layers:list,screen_center:tuple)->None:
+    def draw(self,screen:pygame.Surface,main_sprite:Sprite,layers:dict,screen_center:tuple)->None:
         """
         Draw the sprites sorting them by y coordinate and by layer, positioning the camera to the center of the main sprite.
 
-        The sprites needs to have a z_index, rect and image.
+        The sprites needs to have a z_index, rect and image. Only the sprites touching the screen are drawn, with one 'blits' call per layer.
         """
         self.offset.x = main_sprite.rect.centerx - screen_center[0]
         self.offset.y = main_sprite.rect.centery - screen_center[1]
+        offset_x,offset_y = int(self.offset.x),int(self.offset.y)
+        view = pygame.Rect(offset_x,offset_y,*screen.get_size())
+
+        for layer in (layers.values() if isinstance(layers,dict) else layers):
+            if layer in self.static_layers:
+                screen.blits(self._visible_chunks(layer,view),False)
+            elif layer in self._layers:
+                screen.blits([(sprite.image,sprite.rect.move(-offset_x,-offset_y)) for sprite in self._sorted_layer(layer) if view.colliderect(sprite.rect)],False)
+
+    def _layer_changed(self,z_index:int):
+        self._changed_layers.add(z_index)
+
+    def _sorted_layer(self,z_index:int)->list:
+        order = self._orders.get(z_index,[])
+        if z_index in self._changed_layers:
+            layer = self._layers.get(z_index,{})
+            order = [sprite for sprite in order if sprite in layer]
+            kept = set(order)
+            order.extend(sprite for sprite in layer if sprite not in kept)
+            self._orders[z_index] = order
+            self._changed_layers.discard(z_index)
+        order.sort(key=lambda sprite:sprite.rect.centery)
+        return order
+
+    def _visible_chunks(self,z_index:int,view:pygame.Rect)->list:
+        if self._pending_static:
+            for sprite in list(self._pending_static):
+                if getattr(sprite,"rect",None) is not None:
+                    order = self._static_sprites[sprite][2]
+                    self._remove_static(sprite)
+                    self._add_static(sprite,order)
+        if self._dirty_chunks[z_index]:
+            self._bake(z_index)
+        size = self.static_layers[z_index]
+        chunks = self._chunks[z_index]
+        visible = []
+        for chunk_y in range(view.top//size,(view.bottom-1)//size+1):
+            for chunk_x in range(view.left//size,(view.right-1)//size+1):
+                if (chunk_x,chunk_y) in chunks:
+                    visible.append((chunks[(chunk_x,chunk_y)],(chunk_x*size-view.x,chunk_y*size-view.y)))
+        return visible
+
+    def _bake(self,z_index:int)->None:
+        size = self.static_layers[z_index]
+        chunks = self._chunks[z_index]
+        for chunk in self._dirty_chunks[z_index]:
+            sprites = self._chunk_sprites[z_index].get(chunk)
+            if not sprites:
+                chunks.pop(chunk,None)
+                continue
+            surface = chunks.get(chunk)
+            if surface is None:
+                surface = chunks[chunk] = pygame.Surface((size,size),pygame.SRCALPHA)
+            else:
+                surface.fill((0,0,0,0))
+            left,top = chunk[0]*size,chunk[1]*size
+            ordered = sorted(sprites,key=lambda sprite:(sprite.rect.centery,self._static_sprites[sprite][2]))
+            surface.blits([(sprite.image,sprite.rect.move(-left,-top)) for sprite in ordered],False)
+        self._dirty_chunks[z_index].clear()
+
+    def _add_static(self,sprite,order:int=None):
+        z_index = sprite.z_index
+        size = self.static_layers[z_index]
+        rect = getattr(sprite,"rect",None)
+        if order is None:
+            order = self._counter
+            self._counter += 1
+        if rect is None:
+            self._static_sprites[sprite] = (z_index,[],order)
+            self._pending_static[sprite] = None
+            return
+        chunks = [(chunk_x,chunk_y) for chunk_y in range(rect.top//size,(rect.bottom-1)//size+1) for chunk_x in range(rect.left//size,(rect.right-1)//size+1)]
+        self._static_sprites[sprite] = (z_index,chunks,order)
+        for chunk in chunks:
+            self._chunk_sprites[z_index].setdefault(chunk,[]).append(sprite)
+        self._dirty_chunks[z_index].update(chunks)
+
+    def _remove_static(self,sprite):
+        self._pending_static.pop(sprite,None)
+        z_index,chunks,_ = self._static_sprites.pop(sprite)
+        chunk_sprites = self._chunk_sprites[z_index]
+        for chunk in chunks:
+            chunk_sprites[chunk].remove(sprite)
+            if not chunk_sprites[chunk]:
+                del chunk_sprites[chunk]
+        self._dirty_chunks[z_index].update(chunks)
+
+class SpatialHashGroup(Group):
+    """
+    A group that stores its sprites in grid cells, so the sprites near a rect are found without checking all of them.
+
+    'Sprite.collision' uses it automatically when it's the collision group. The helper sprites update their cells when they move with their methods, after moving sprites by hand call 'move' (or 'refresh' for all of them).
+    """
+    def __init__(self,cell_size:int=128):
+        self.cell_size = cell_size
+        self._cells = {}
+        self._sprite_cells = {}
+        # sprites that joined without a rect, indexed when they get one
+        self._pending = {}
+        self._order = {}
+        self._counter = 0
+        super().__init__()
+
+    def add_internal(self,sprite,layer=None):
+        super().add_internal(sprite)
+        self._order[sprite] = self._counter
+        self._counter += 1
+        self._insert(sprite,self._cell_range(sprite))
+
+    def remove_internal(self,sprite):
+        self._remove(sprite)
+        del self._order[sprite]
+        super().remove_internal(sprite)
+
+    def move(self,sprite:Sprite)->None:
+        """
+        Update the cells of a sprite after it moved or changed size.
+        """
+        cell_range = self._cell_range(sprite)
+        if cell_range != self._sprite_cells.get(sprite):
+            self._remove(sprite)
+            self._insert(sprite,cell_range)
+
+    def refresh(self)->None:
+        """
+        Update the cells of every sprite that moved.
+        """
+        for sprite in self.spritedict:
+            cell_range = self._cell_range(sprite)
+            if cell_range != self._sprite_cells.get(sprite):
+                self._remove(sprite)
+                self._insert(sprite,cell_range)
+
+    def candidates(self,rect:pygame.Rect)->List[Sprite]:
+        """
+        Return the sprites in the cells touched by the rect (in the order they were added), without checking if they actually collide.
+        """
+        if self._pending:
+            self._index_pending()
+        cell_size = self.cell_size
+        left,top = rect.left//cell_size,rect.top//cell_size
+        right,bottom = max(rect.left,rect.right-1)//cell_size,max(rect.top,rect.bottom-1)//cell_size
+        if left == right and top == bottom:
+            return sorted(self._cells.get((left,top),()),key=self._order.__getitem__)
+        found = {}
+        cells = self._cells
+        for x in range(left,right+1):
+            for y in range(top,bottom+1):
+                if (x,y) in cells:
+                    found.update(cells[(x,y)])
+        return sorted(found,key=self._order.__getitem__)
+
+    def query(self,rect:pygame.Rect)->List[Sprite]:
+        """
+        Return the sprites whose hitbox (or rect if they don't have one) collides with the rect.
+        """
+        colliding = []
+        for sprite in self.candidates(rect):
+            box = sprite.hitbox if hasattr(sprite,"hitbox") else sprite.rect
+            if box.colliderect(rect):
+                colliding.append(sprite)
+        return colliding
+
+    def iter_query(self,rect:pygame.Rect):
+        """
+        Yield the sprites colliding with the rect in the order they were added. If the rect is moved while iterating, the next sprites are searched at its new position.
+        """
+        last = tuple(rect)
+        pending = self.query(rect)
+        pending.reverse()
+        while pending:
+            sprite = pending.pop()
+            order = self._order.get(sprite,-1)
+            yield sprite
+            if tuple(rect) != last:
+                last = tuple(rect)
+                pending = [other for other in self.query(rect) if self._order[other] > order]
+                pending.reverse()
+
+    def query_point(self,pos:Tuple[int,int])->List[Sprite]:
+        """
+        Return the sprites whose rect contains the point, topmost first (higher z_index, then added later). Useful to find the sprite under the mouse.
+        """
+        if self._pending:
+            self._index_pending()
+        x,y = int(pos[0]),int(pos[1])
+        found = [sprite for sprite in self._cells.get((x//self.cell_size,y//self.cell_size),()) if sprite.rect.collidepoint(x,y)]
+        found.sort(key=self._z_key,reverse=True)
+        return found
+
+    def query_rect(self,rect:pygame.Rect,hitbox:bool=False)->List[Sprite]:
+        """
+        Return the sprites whose rect (or hitbox) collides with the rect, in drawing order (lower z_index, then added first).
+        """
+        rect = pygame.Rect(rect)
+        if hitbox:
+            found = self.query(rect)
+        else:
+            found = [sprite for sprite in self.candidates(rect) if sprite.rect.colliderect(rect)]
+        found.sort(key=self._z_key)
+        return found
+
+    def query_visible(self,view:pygame.Rect)->List[Sprite]:
+        """
+        Return the sprites on the view (the screen rect in world coordinates) in drawing order, to draw only them.
+        """
+        return self.query_rect(view)
+
+    def _z_key(self,sprite)->Tuple[int,int]:
+        return getattr(sprite,"z_index",0),self._order[sprite]
+
+    def _bounds(self,sprite)->pygame.Rect:
+        """
+        The rect stored in the cells: the union of rect and hitbox.
+        """
+        rect = getattr(sprite,"rect",None)
+        hitbox = getattr(sprite,"hitbox",None)
+        if rect is not None and hitbox is not None:
+            return rect.union(hitbox)
+        return rect if rect is not None else hitbox
+
+    def _cell_range(self,sprite)->Tuple[int,int,int,int]:
+        bounds = self._bounds(sprite)
+        if bounds is None:
+            return None
+        cell_size = self.cell_size
+        return (bounds.left//cell_size,bounds.top//cell_size,max(bounds.left,bounds.right-1)//cell_size,max(bounds.top,bounds.bottom-1)//cell_size)
+
+    def _index_pending(self):
+        for sprite in list(self._pending):
+            cell_range = self._cell_range(sprite)
+            if cell_range:
+                self._remove(sprite)
+                self._insert(sprite,cell_range)
+
+    def _insert(self,sprite,cell_range:Tuple[int,int,int,int]):
+        self._sprite_cells[sprite] = cell_range
+        if cell_range is None:
+            self._pending[sprite] = None
+        else:
+            for x in range(cell_range[0],cell_range[2]+1):
+                for y in range(cell_range[1],cell_range[3]+1):
+                    self._cells.setdefault((x,y),{})[sprite] = None
+
+    def _remove(self,sprite):
+        self._pending.pop(sprite,None)
+        cell_range = self._sprite_cells.pop(sprite,None)
+        if cell_range:
+            for x in range(cell_range[0],cell_range[2]+1):
+                for y in range(cell_range[1],cell_range[3]+1):
+                    cell = self._cells[(x,y)]
+                    del cell[sprite]
+                    if not cell:
+                        del self._cells[(x,y)]
+
+class ArrayGroup(Group):
+    """
+    A group that keeps the positions, directions and speeds of its sprites in NumPy arrays, to move all of them in one step with 'update_positions'.
+
+    While a sprite is in the group the arrays hold its real state: after changing its position, direction or speed call 'refresh'. The arrays can also be changed directly (rows follow 'index').
+    """
+    def __init__(self,capacity:int=64):
+        if numpy is None:
+            raise ImportError("ArrayGroup needs NumPy to be installed.")
+        self._members = []
+        self._vectors = []
+        self._indexes = {}
+        self._centers = numpy.zeros((capacity,2),dtype=int)
+        self._positions = numpy.zeros((capacity,2))
+        self._directions = numpy.zeros((capacity,2))
+        self._speeds = numpy.zeros((capacity,2))
+        super().__init__()
+
+    @property
+    def positions(self):
+        """
+        The positions array (one row per sprite). Views become outdated when sprites are added or removed.
+        """
+        return self._positions[:len(self._members)]
+
+    @property
+    def directions(self):
+        return self._directions[:len(self._members)]
+
+    @property
+    def speeds(self):
+        return self._speeds[:len(self._members)]
+
+    def index(self,sprite:Sprite)->int:
+        """
+        Return the row of a sprite in the arrays.
+        """
+        return self._indexes[sprite]
+
+    def add_internal(self,sprite,layer=None):
+        super().add_internal(sprite)
+        count = len(self._members)
+        if count == len(self._positions):
+            size = max(count*2,1)
+            self._centers = numpy.resize(self._centers,(size,2))
+            self._positions = numpy.resize(self._positions,(size,2))
+            self._directions = numpy.resize(self._directions,(size,2))
+            self._speeds = numpy.resize(self._speeds,(size,2))
+        self._indexes[sprite] = count
+        self._members.append(sprite)
+        self._vectors.append(None)
+        self.refresh(sprite)
+
+    def remove_internal(self,sprite):
+        index = self._indexes.pop(sprite)
+        last = self._members.pop()
+        last_vector = self._vectors.pop()
+        if last is not sprite:
+            count = len(self._members)
+            self._members[index] = last
+            self._vectors[index] = last_vector
+            self._indexes[last] = index
+            self._centers[index] = self._centers[count]
+            self._positions[index] = self._positions[count]
+            self._directions[index] = self._directions[count]
+            self._speeds[index] = self._speeds[count]
+        super().remove_internal(sprite)
+
+    def refresh(self,sprite:Sprite=None)->None:
+        """
+        Copy the position, direction and speed of a sprite (or of all of them) in the arrays. LightSprites use their x, y, direction_x/y and speed_x/y.
+        """
+        for member in [sprite] if sprite else self._members:
+            index = self._indexes[member]
+            self._vectors[index] = getattr(member,"position",None)
+            self._centers[index] = member.rect.center
+            if hasattr(member,"position"):
+                self._positions[index] = member.position
+                self._directions[index] = member.direction
+                self._speeds[index] = member.speed
+            elif hasattr(member,"direction_x"):
+                # LightSprite
+                self._positions[index] = (member.x,member.y)
+                self._directions[index] = (member.direction_x,member.direction_y)
+                self._speeds[index] = (member.speed_x,member.speed_y)
+            else:
+                self._positions[index] = member.rect.center
+                self._directions[index] = (0,0)
+                self._speeds[index] = (0,0)
+
+    def update_positions(self,dt=1,write_back:bool=True)->None:
+        """
+        Move every sprite using its speed and direction, like 'Sprite.update_positions'.
+
+        With 'write_back' the sprite position, rect and hitbox are updated too, otherwise only the arrays change.
+        """
+        count = len(self._members)
+        positions = self._positions[:count]
+        positions += self._directions[:count]*self._speeds[:count]*dt
+        if write_back:
+            self.write_back()
+
+    def write_back(self)->None:
+        """
+        Copy the positions array back to the sprites position, and to the rect and hitbox centers of the sprites whose rounded position changed (updating their spatial groups too).
+        """
+        count = len(self._members)
+        positions = self._positions[:count]
+        for member,vector,(x,y) in zip(self._members,self._vectors,positions.tolist()):
+            if vector is not None:
+                vector.update(x,y)
+            elif hasattr(member,"direction_x"):
+                member.x,member.y = x,y
+        centers = numpy.rint(positions).astype(int)
+        moved = numpy.flatnonzero((centers != self._centers[:count]).any(axis=1))
+        self._centers[:count] = centers
+        members = self._members
+        for index,center in zip(moved.tolist(),centers[moved].tolist()):
+            sprite = members[index]
+            sprite.rect.center = center
+            if hasattr(sprite,"hitbox"):
+                sprite.hitbox.center = center
+            if hasattr(sprite,"_notify_moved"):
+                sprite._notify_moved()
+
+class AnimationGroup(Group):
+    """
+    A group that animates all its animated sprites in one pass with a shared clock, instead of calling 'animate' on every sprite.
+
+    The image is changed only when the frame changes. Sprites outside the view rect are skipped but keep their phase, so they show the right frame when they come back.
+    """
+    def __init__(self,kill_at_end:bool=False):
+        super().__init__()
+        self.time = 0.0
+        self.kill_at_end = kill_at_end
+        # sprite: [start time, start index, frame speed, frames, frame]
+        self._states = {}
+
+    def add_internal(self,sprite,layer=None):
+        super().add_internal(sprite,layer)
+        self._states[sprite] = self._state(sprite,self.time)
+
+    def remove_internal(self,sprite):
+        super().remove_internal(sprite)
+        self._states.pop(sprite,None)
+
+    def animate(self,dt:float=1.0,view_rect:pygame.Rect=None,resize_rect:bool=False)->None:
+        """
+        Advance the clock and update the frame index and image of the sprites (touching 'view_rect' if given).
+
+        Changing the frame speed, the frame index, the frames or the current animation of a sprite restarts its phase from its frame index.
+        """
+        self.time += dt
+        time = self.time
+        for sprite,state in list(self._states.items()):
+            if view_rect is not None and not view_rect.colliderect(sprite.rect):
+                continue
+            frames = sprite.animations[sprite.current_animation] if hasattr(sprite,"animations") else sprite.frames
+            if frames is not state[3] or sprite.frame_speed != state[2] or int(sprite.frame_index) != state[4]:
+                state = self._states[sprite] = self._state(sprite,time-dt)
+                state[4] = -1
+
+            index = state[1]+(time-state[0])*state[2]
+            if index >= len(frames):
+                if self.kill_at_end and not hasattr(sprite,"animations"):
+                    sprite.kill()
+                    continue
+                index %= len(frames)
+            sprite.frame_index = index
+
+            frame = int(index)
+            if frame != state[4]:
+                state[4] = frame
+                sprite.image = frames[frame]
+                if resize_rect:
+                    sprite.resize_rect()
+
+    def _state(self,sprite,time:float)->list:
+        frames = sprite.animations[sprite.current_animation] if hasattr(sprite,"animations") else sprite.frames
+        return [time,sprite.frame_index,sprite.frame_speed,frames,int(sprite.frame_index)]
+
+class DirtyGroup(Group):
+    """
+    A group that redraws only what changed, for mostly static screens. Use it with 'update_window(...,dirty_rects=group.draw(screen))'.
+
+    A sprite changed if its rect or image changed, or if it has 'dirty' set to True (reset after the draw, 2 redraws it always).
+    """
+    def __init__(self,background:Union[pygame.Surface,str,Tuple[int,int,int]]="black"):
+        self.background = background
+        # sprite: (rect, image) when it was drawn
+        self._drawn = {}
+        self._lost = []
+        self._repaint = True
+        super().__init__()
+
+    def remove_internal(self,sprite):
+        super().remove_internal(sprite)
+        drawn = self._drawn.pop(sprite,None)
+        if drawn:
+            self._lost.append(drawn[0])
 
-        for layer in layers.values():
-            for sprite in sorted(self.sprites(),key=lambda sprite:sprite.rect.centery):
-                if sprite.z_index == layer:
-                    offset_rect = sprite.rect.copy()
-                    offset_rect.center -= self.offset
+    def set_background(self,background:Union[pygame.Surface,str,Tuple[int,int,int]])->None:
+        """
+        Set the surface (or color) drawn under the sprites, and redraw everything.
+        """
+        self.background = background
+        self.repaint()
 
-                    screen.blit(sprite.image, offset_rect)
+    def repaint(self)->None:
+        """
+        Redraw the whole surface on the next draw.
+        """
+        self._repaint = True
+
+    def draw(self,surface:pygame.Surface)->List[pygame.Rect]:
+        """
+        Restore the background under the changed areas, redraw the sprites touching them and return the areas.
+        """
+        drawn = self._drawn
+        sprites = self.sprites()
+        if self._repaint:
+            areas = [surface.get_rect()]
+            redraw = set(sprites)
+            self._repaint = False
+        else:
+            areas = self._lost
+            redraw = set()
+            for sprite in sprites:
+                last = drawn.get(sprite)
+                if last is None:
+                    areas.append(sprite.rect.copy())
+                elif getattr(sprite,"dirty",False) or sprite.rect != last[0] or sprite.image is not last[1]:
+                    areas.append(last[0])
+                    areas.append(sprite.rect.copy())
+                else:
+                    continue
+                redraw.add(sprite)
+
+            # the sprites under the restored areas are redrawn, and their rects are restored too
+            expanded = True
+            while expanded:
+                expanded = False
+                for sprite in sprites:
+                    if sprite not in redraw and sprite.rect.collidelist(areas) != -1:
+                        redraw.add(sprite)
+                        areas.append(sprite.rect.copy())
+                        expanded = True
+        self._lost = []
+
+        bounds = surface.get_rect()
+        areas = [area.clip(bounds) for area in areas]
+        areas = [area for area in areas if area.w and area.h]
+        for area in areas:
+            if isinstance(self.background,pygame.Surface):
+                surface.blit(self.background,area,area)
+            else:
+                surface.fill(self.background,area)
+
+        surface.blits([(sprite.image,sprite.rect) for sprite in sprites if sprite in redraw],False)
+        for sprite in redraw:
+            drawn[sprite] = (sprite.rect.copy(),sprite.image)
+            if getattr(sprite,"dirty",False) == 1:
+                sprite.dirty = False
+        return areas
+
+# POOLS
+class SpritePool():
+    """
+    Keep the sprites that are spawned and killed often (bullets, effects) to reuse them, instead of creating new ones every time.
+
+    The factory is called without arguments and must return a new sprite, like 'lambda: Sprite(bullet_image,(0,0))'.
+    """
+    def __init__(self,factory,size:int=0,groups:Union[pygame.sprite.Group,List[pygame.sprite.Group]]=[],reset=None):
+        self.factory = factory
+        self.groups = groups
+        self.reset = reset
+        self._free = []
+        self._active = {}
+        self.prewarm(size)
+
+    def __len__(self):
+        return len(self._active)
+
+    def prewarm(self,count:int)->None:
+        """
+        Create sprites until there are at least 'count' free ones.
+        """
+        while len(self._free) < count:
+            self._free.append(self.factory())
+
+    def acquire(self,position:Tuple[float,float]=None,direction:Tuple[float,float]=None,speed:Tuple[float,float]=None,**attributes)->Sprite:
+        """
+        Return a free sprite (a new one if there are none) added to the pool groups, with its vectors (or LightSprite fields), rect and hitbox updated in place.
+
+        Other keyword arguments are set as attributes, then the 'reset' function is called with the sprite, if any.
+        """
+        sprite = self._free.pop() if self._free else self.factory()
+        vectors = hasattr(sprite,"position")
+        if position is not None:
+            if vectors:
+                sprite.position.update(position)
+                x,y = sprite.position.x,sprite.position.y
+            else:
+                # LightSprite
+                x,y = sprite.x,sprite.y = position
+            if hasattr(sprite,"rect"):
+                sprite.rect.centerx = round(x)
+                sprite.rect.centery = round(y)
+                if hasattr(sprite,"hitbox"):
+                    sprite.hitbox.centerx = sprite.rect.centerx
+                    sprite.hitbox.centery = sprite.rect.centery
+        if direction is not None:
+            if vectors:
+                sprite.direction.update(direction)
+            else:
+                sprite.direction_x,sprite.direction_y = direction
+        if speed is not None:
+            if vectors:
+                sprite.speed.update(speed)
+            else:
+                sprite.speed_x,sprite.speed_y = speed
+        if hasattr(sprite,"frame_index"):
+            sprite.frame_index = 0
+            sprite.image = sprite.animations[sprite.current_animation][0] if hasattr(sprite,"animations") else sprite.frames[0]
+        for name,value in attributes.items():
+            setattr(sprite,name,value)
+        if self.reset:
+            self.reset(sprite)
+        sprite.add(self.groups)
+        self._active[sprite] = None
+        return sprite
+
+    def release(self,sprite:Sprite)->None:
+        """
+        Remove the sprite from all its groups and keep it for the next 'acquire'.
+        """
+        if sprite in self._active:
+            del self._active[sprite]
+            sprite.kill()
+            self._free.append(sprite)
+
+    def collect(self)->int:
+        """
+        Take back the acquired sprites that were killed instead of released. Return how many.
+        """
+        dead = [sprite for sprite in self._active if not sprite.alive()]
+        for sprite in dead:
+            self.release(sprite)
+        return len(dead)
+
+    def clear(self)->None:
+        """
+        Forget the free sprites.
+        """
+        self._free.clear()
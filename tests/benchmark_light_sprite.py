@@ -0,0 +1,29 @@
+"""
+BENCHMARK: memory and update time of LightSprite compared to Sprite.
+"""
+
+import os,time,tracemalloc
+os.environ.setdefault("SDL_VIDEODRIVER","dummy")
+import pygame
+from pygame_helper import sprites
+
+COUNT = 20000
+FRAMES = 30
+
+pygame.init()
+image = pygame.Surface((4,4))
+
+for sprite_type in [sprites.Sprite,sprites.LightSprite]:
+	group = sprites.Group()
+	tracemalloc.start()
+	entities = [sprite_type(image,(i%800,i//800),group,direction=(1,0.5),speed=(3,3)) for i in range(COUNT)]
+	memory = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+
+	start = time.perf_counter()
+	for _ in range(FRAMES):
+		for entity in entities:
+			entity.update_positions()
+	elapsed = time.perf_counter()-start
+
+	print(f"{sprite_type.__name__}: {memory/COUNT:.0f} bytes per sprite, {elapsed/FRAMES*1000:.2f} ms per frame for {COUNT} sprites")